@@ -0,0 +1,45 @@
+'''
+Micro-benchmark of the ODS dates parsing.
+
+A dataset `modified` timestamp is parsed by each processing stage
+(incremental check, dataset, API exports, alternative exports and attachments).
+
+Usage: python benchmarks/bench_dates.py [datasets]
+'''
+import sys
+import timeit
+
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse as dateutil_parse
+
+from udata_ods.dates import parse_date
+
+# Parses of the same timestamp per processed dataset
+PARSES_PER_DATASET = 6
+
+
+def timestamps(count):
+    start = datetime(2015, 4, 9, 10, 28, 45)
+    return [(start + timedelta(minutes=i)).isoformat() + '+00:00' for i in range(count)]
+
+
+def run(parse, values):
+    for value in values:
+        for _ in range(PARSES_PER_DATASET):
+            parse(value)
+
+
+def main(count=10000):
+    values = timestamps(count)
+    results = {}
+    for name, parse in (('dateutil', dateutil_parse), ('udata_ods', parse_date)):
+        parse_date.cache_clear()
+        results[name] = min(timeit.repeat(lambda: run(parse, values), number=1, repeat=3))
+        print('{0:>10}: {1:.3f}s ({2:.1f}µs per dataset)'.format(
+            name, results[name], results[name] / count * 1e6))
+    print('   speedup: {0:.1f}x'.format(results['dateutil'] / results['udata_ods']))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,197 @@
+'''
+Benchmark the ODS harvester against a synthetic local portal.
+
+Each scenario harvests a synthetic catalog into MongoDB (harvested datasets are removed afterward)
+and reports, for the `initialize` and `process` stages,
+their throughput (datasets per second), peak traced memory and requests by endpoint.
+
+Usage:
+    python benchmarks/bench_harvest.py --sizes 1000,10000 --latency 0.005
+    python benchmarks/bench_harvest.py --feature batch_details --setting ODS_BATCH_SIZE=50
+    python benchmarks/bench_harvest.py --check  # Fail on thresholds.json regressions
+'''
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from os.path import dirname, join
+
+sys.path.insert(0, dirname(__file__))
+
+from portal import Portal  # noqa: E402
+
+THRESHOLDS = join(dirname(__file__), 'thresholds.json')
+
+
+def parse_setting(value):
+    key, _, raw = value.partition('=')
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def create_app(mongodb, settings):
+    from udata.app import create_app
+
+    class Settings(object):
+        PLUGINS = ['ods']
+        MONGODB_HOST = mongodb
+        # The synthetic portal is served locally
+        URLS_ALLOW_LOCAL = True
+        URLS_ALLOW_PRIVATE = True
+
+    for key, value in settings.items():
+        setattr(Settings, key, value)
+    return create_app(override=Settings)
+
+
+class Stage(object):
+    '''Measure the wall time, peak traced memory and requests of a harvest stage'''
+    def __init__(self, portal, trace_memory):
+        self.portal = portal
+        self.trace_memory = trace_memory
+
+    def __enter__(self):
+        self.requests = dict(self.portal.requests)
+        if self.trace_memory:
+            tracemalloc.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        self.peak_memory = None
+        if self.trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.requests = {key: value - self.requests.get(key, 0)
+                         for key, value in self.portal.requests.items()
+                         if value - self.requests.get(key, 0)}
+
+    def report(self, count):
+        return {
+            'seconds': round(self.elapsed, 3),
+            'throughput': round(count / self.elapsed, 1) if self.elapsed else None,
+            'peak_memory_mb': (round(self.peak_memory / 1024 ** 2, 1)
+                               if self.peak_memory is not None else None),
+            'requests': self.requests,
+        }
+
+
+def run_scenario(size, args):
+    from udata.harvest.models import HarvestJob, HarvestSource
+    from udata.models import Dataset
+
+    from udata_ods.harvesters import OdsBackend
+
+    with Portal(size, latency=args.latency, seed=args.seed) as portal:
+        source = HarvestSource.objects.create(
+            name='ODS benchmark {0}'.format(size), url=portal.url, backend='ods',
+            config={'features': {name: True for name in args.feature}},
+        )
+        try:
+            backend = OdsBackend(source)
+            with Stage(portal, args.memory) as initialize:
+                job = backend.perform_initialization()
+            if job is None:
+                raise RuntimeError('Initialization failed: {0}'.format(
+                    '; '.join(error.message for error in backend.job.errors)))
+            with Stage(portal, args.memory) as process:
+                backend.process_items()
+            backend.finalize()
+            statuses = {}
+            for item in backend.job.items:
+                statuses[item.status] = statuses.get(item.status, 0) + 1
+        finally:
+            Dataset.objects(harvest__source_id=str(source.id)).delete()
+            HarvestJob.objects(source=source).delete()
+            source.delete()
+    return {
+        'datasets': size,
+        'items': statuses,
+        'initialize': initialize.report(size),
+        'process': process.report(size),
+    }
+
+
+def check(results, thresholds):
+    '''List the thresholds exceeded by the results'''
+    failures = []
+    for result in results:
+        for stage, limits in thresholds.get(str(result['datasets']), {}).items():
+            measured = result[stage]
+            if 'min_throughput' in limits and measured['throughput'] < limits['min_throughput']:
+                failures.append('{0} {1}: {2} datasets/s < {3}'.format(
+                    result['datasets'], stage, measured['throughput'], limits['min_throughput']))
+            if ('max_peak_memory_mb' in limits and measured['peak_memory_mb'] is not None
+                    and measured['peak_memory_mb'] > limits['max_peak_memory_mb']):
+                failures.append('{0} {1}: {2}MB > {3}MB'.format(
+                    result['datasets'], stage, measured['peak_memory_mb'],
+                    limits['max_peak_memory_mb']))
+            requests = sum(measured['requests'].values())
+            if 'max_requests' in limits and requests > limits['max_requests']:
+                failures.append('{0} {1}: {2} requests > {3}'.format(
+                    result['datasets'], stage, requests, limits['max_requests']))
+    return failures
+
+
+def print_results(results):
+    row = '{0:>8} {1:>10} {2:>10} {3:>12} {4:>10}  {5}'
+    print(row.format('datasets', 'stage', 'seconds', 'datasets/s', 'peak MB', 'requests'))
+    for result in results:
+        for stage in 'initialize', 'process':
+            measured = result[stage]
+            requests = ' '.join('{0}={1}'.format(*r) for r in sorted(measured['requests'].items()))
+            print(row.format(result['datasets'], stage, measured['seconds'],
+                             measured['throughput'], measured['peak_memory_mb'] or '-', requests))
+        items = ' '.join('{0}={1}'.format(*r) for r in sorted(result['items'].items()))
+        print('{0:>8} {1:>10}  {2}'.format(result['datasets'], 'items', items))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1000',
+                        help='Comma separated catalog sizes (ie. 1000,10000,100000)')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Portal responses latency in seconds')
+    parser.add_argument('--seed', type=int, default=0, help='Synthetic catalog seed')
+    parser.add_argument('--feature', action='append', default=[],
+                        help='Enable an ODS harvester feature (repeatable)')
+    parser.add_argument('--setting', action='append', default=[], type=parse_setting,
+                        help='Override an application setting as KEY=JSON (repeatable)')
+    parser.add_argument('--mongodb', default=os.environ.get('MONGODB_HOST',
+                                                            'mongodb://localhost:27017/udata'),
+                        help='MongoDB URI')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='Do not trace memory (tracing slows the harvest down)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--check', action='store_true',
+                        help='Exit with an error if a threshold is exceeded')
+    parser.add_argument('--thresholds', default=THRESHOLDS, help='Thresholds JSON file')
+    args = parser.parse_args()
+
+    app = create_app(args.mongodb, dict(args.setting))
+    results = []
+    with app.test_request_context():
+        for size in (int(size) for size in args.sizes.split(',')):
+            results.append(run_scenario(size, args))
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.check:
+        with open(args.thresholds) as f:
+            failures = check(results, json.load(f))
+        for failure in failures:
+            print('✘ {0}'.format(failure))
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
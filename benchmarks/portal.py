@@ -0,0 +1,243 @@
+'''
+A synthetic ODS portal served locally for benchmarks.
+
+Datasets are generated on demand and deterministically from their index and a seed,
+so catalogs of any size can be served without being held in memory.
+
+    with Portal(10000, latency=0.01) as portal:
+        harvest(portal.url)
+        print(portal.requests)
+'''
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from urllib.request import urlopen
+
+START = datetime(2020, 1, 1)
+
+LICENSES = (
+    'Licence Ouverte (Etalab)',
+    'Licence Ouverte v2.0 (Etalab)',
+    'Open Database License (ODbL)',
+    'CC BY 4.0',
+    None,
+)
+
+THEMES = ('Culture, Heritage', 'Environment', 'Transport, Mobility', 'Health', 'Economy')
+
+FIELD_TYPES = ('text', 'int', 'double', 'date', 'datetime', 'geo_point_2d')
+
+BOILERPLATE = ('<p>Données publiées par la collectivité dans le cadre de sa démarche '
+               "d'ouverture des données publiques.</p>")
+
+DATASET_ID = re.compile(r'datasetid:"([^"]+)"')
+
+
+def dataset_id(index):
+    return 'dataset-{0:06d}'.format(index)
+
+
+def dataset_index(dataset_id):
+    try:
+        return int(dataset_id.rsplit('-', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def generate_dataset(index, seed=0):
+    '''Build the ODS search API payload of the dataset at `index`'''
+    rng = random.Random('{0}-{1}'.format(seed, index))
+    identifier = dataset_id(index)
+    # Most datasets have a few fields, some have hundreds
+    fields_count = min(int(rng.paretovariate(1.2) * 4), 500)
+    attachments_count = rng.choice((0, 0, 0, 0, 1, 2, 5)) if rng.random() < 0.95 else 50
+    geo = rng.random() < 0.3
+    has_records = rng.random() < 0.9
+    if rng.random() < 0.5:
+        description = BOILERPLATE
+    else:
+        description = ''.join('<p>{0} paragraph {1}.</p>'.format(identifier, i)
+                              for i in range(rng.randint(1, 20)))
+    return {
+        'datasetid': identifier,
+        'metas': {
+            'publisher': 'Publisher {0}'.format(rng.randint(1, 20)),
+            'domain': 'benchmark',
+            'title': 'Dataset {0}'.format(index),
+            'description': description,
+            'license': rng.choice(LICENSES),
+            'records_count': rng.randint(0, 10 ** 6) if has_records else 0,
+            'modified': (START + timedelta(minutes=index)).isoformat() + '+00:00',
+            'language': 'fr',
+            'theme': rng.sample(THEMES, rng.randint(0, 2)),
+            'keyword': ['keyword-{0}'.format(rng.randint(1, 200))
+                        for _ in range(rng.randint(0, 5))],
+            'references': 'http://example.com/{0}'.format(identifier),
+        },
+        'has_records': has_records,
+        'features': ['geo', 'analyze'] if geo else ['analyze'],
+        'fields': [{
+            'name': 'field_{0}'.format(i),
+            'label': 'Field {0}'.format(i),
+            'type': rng.choice(FIELD_TYPES),
+            'description': 'Description of field {0}'.format(i) if i % 3 == 0 else None,
+        } for i in range(fields_count)],
+        'attachments': [{
+            'id': 'attachment_{0}_pdf'.format(i),
+            'title': 'Attachment {0}'.format(i),
+            'url': 'odsfile://attachment-{0}.pdf'.format(i),
+            'mimetype': 'application/pdf',
+        } for i in range(attachments_count)],
+        'alternative_exports': [{
+            'id': 'export_{0}_zip'.format(i),
+            'title': 'Export {0}'.format(i),
+            'url': 'odsfile://export-{0}.zip'.format(i),
+            'mimetype': 'application/zip',
+            'description': None,
+        } for i in range(rng.choice((0, 0, 1, 3)))],
+    }
+
+
+class PortalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        catalog = self.server.catalog
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == '/_requests':
+            return self.send_json(self.server.requests)
+        if catalog.latency:
+            time.sleep(catalog.latency)
+        if url.path == '/api/datasets/1.0/search/':
+            self.count('search')
+            self.send_json(catalog.search(params))
+        elif url.path == '/api/explore/v2.1/catalog/exports/jsonl':
+            self.count('export')
+            self.send_body(catalog.export(), 'application/jsonl')
+        elif url.path.startswith('/api/datasets/1.0/'):
+            self.count('dataset')
+            index = dataset_index(url.path.rstrip('/').rsplit('/', 1)[-1])
+            if index is None or not 0 <= index < catalog.size:
+                self.send_body(b'{"error": "Unknown dataset"}', 'application/json', 404)
+            else:
+                self.send_json(catalog.dataset(index))
+        else:
+            self.count('unknown')
+            self.send_body(b'{}', 'application/json', 404)
+
+    def count(self, endpoint):
+        with self.server.lock:
+            self.server.requests[endpoint] += 1
+
+    def send_json(self, data):
+        self.send_body(json.dumps(data).encode('utf-8'), 'application/json')
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Catalog(object):
+    '''The ODS APIs responses for a synthetic catalog of `size` datasets'''
+    def __init__(self, size, latency=0, seed=0, max_rows=1000):
+        self.size = size
+        self.latency = latency
+        self.seed = seed
+        self.max_rows = max_rows
+
+    def dataset(self, index):
+        return generate_dataset(index, self.seed)
+
+    def search(self, params):
+        ids = DATASET_ID.findall(params.get('q', ''))
+        if ids:
+            indexes = [index for index in map(dataset_index, ids)
+                       if index is not None and 0 <= index < self.size]
+            nhits = len(indexes)
+        else:
+            start = int(params.get('start', 0))
+            rows = min(int(params.get('rows', 10)), self.max_rows)
+            indexes = range(start, min(start + rows, self.size))
+            nhits = self.size
+        return {
+            'nhits': nhits,
+            'parameters': {'rows': len(indexes), 'format': 'json'},
+            'datasets': [self.dataset(index) for index in indexes],
+        }
+
+    def export(self):
+        lines = []
+        for index in range(self.size):
+            modified = (START + timedelta(minutes=index)).isoformat() + '+00:00'
+            lines.append(json.dumps({
+                'dataset_id': dataset_id(index),
+                'metas': {'default': {'modified': modified}},
+            }))
+        return '\n'.join(lines).encode('utf-8')
+
+
+def serve(catalog, ports):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PortalHandler)
+    server.daemon_threads = True
+    server.catalog = catalog
+    server.requests = Counter()
+    server.lock = threading.Lock()
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+class Portal(object):
+    '''
+    A local HTTP server mimicking the ODS APIs used by the harvester
+    for a synthetic catalog of `size` datasets.
+
+    Each response is delayed by `latency` seconds and requests are counted by endpoint.
+    The server runs in its own process so it does not weigh on the measured harvest.
+    '''
+    def __init__(self, size, latency=0, seed=0, max_rows=1000):
+        self.catalog = Catalog(size, latency, seed, max_rows)
+        self.process = None
+        self.port = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.port)
+
+    @property
+    def requests(self):
+        '''Requests counts by endpoint'''
+        with urlopen(self.url + '/_requests') as response:
+            return json.load(response)
+
+    def start(self):
+        ports = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=serve, args=(self.catalog, ports),
+                                               daemon=True)
+        self.process.start()
+        self.port = ports.get(timeout=30)
+        return self
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -121,6 +121,9 @@ setup(
         'udata.models': [
             'ods = udata_ods.models',
         ],
+        'udata.commands': [
+            'ods = udata_ods.commands',
+        ],
         'udata.views': [
             'ods = udata_ods.views',
         ],
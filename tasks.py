@@ -77,6 +77,17 @@ def cover(ctx, html=False):
         ctx.run(cmd, pty=True)
 
 
+@task
+def bench(ctx, sizes='1000,10000', check=True):
+    '''Run the harvest benchmarks against a synthetic portal'''
+    header(bench.__doc__)
+    cmd = 'python benchmarks/bench_harvest.py --sizes {0}'.format(sizes)
+    if check:
+        cmd = ' '.join((cmd, '--check'))
+    with ctx.cd(ROOT):
+        ctx.run(cmd, pty=True)
+
+
 @task
 def qa(ctx):
     '''Run a quality report'''
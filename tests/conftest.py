@@ -0,0 +1,11 @@
+import pytest
+
+from udata_ods import breaker, ratelimit, transport
+
+
+@pytest.fixture(autouse=True)
+def clear_registries():
+    '''Do not share the process-wide breakers, limiters and transports between tests'''
+    yield
+    for registry in breaker._breakers, ratelimit._limiters, transport._transports:
+        registry.clear()
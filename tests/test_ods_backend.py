@@ -1,19 +1,23 @@
 import json
 
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from os.path import join, dirname
 from urllib.parse import parse_qs, urlparse
 
 import pytest
+import requests
+
+from mongoengine import ValidationError
 
 from udata.models import Dataset, License
 from udata.core.organization.factories import OrganizationFactory
 from udata.harvest import actions
-from udata.harvest.tests.factories import HarvestSourceFactory
+from udata.harvest.tests.factories import HarvestJobFactory, HarvestSourceFactory
 from udata.i18n import gettext as _
 from udata.utils import faker
 
-from udata_ods.harvesters import OdsBackend
+from udata_ods.harvesters import OdsBackend, html_to_markdown
+from udata_ods.licenses import clear_license_caches
 
 DATA_DIR = join(dirname(__file__), 'data')
 DOMAIN = 'etalab-sandbox.opendatasoft.com'
@@ -67,8 +71,29 @@ def get_qs(request, name):
     return request.qs[name][0]
 
 
+def paginated_search(datasets):
+    '''A search API mock paginating over `datasets`'''
+    def search(request, context):
+        start = int(get_qs(request, 'start'))
+        rows = int(get_qs(request, 'rows'))
+        context.status_code = 200
+        return {'nhits': len(datasets), 'datasets': datasets[start:start + rows]}
+    return search
+
+
+def many_datasets(count, template='test-a'):
+    '''Generate `count` distinct ODS datasets from a template'''
+    datasets = []
+    for i in range(count):
+        data = ods_dataset(template)
+        data['datasetid'] = data['metas']['title'] = '{0}-{1}'.format(template, i)
+        datasets.append(data)
+    return datasets
+
+
 @pytest.fixture(autouse=True)
 def inject_licenses(clean_db):
+    clear_license_caches()
     for license_id in set(OdsBackend.LICENSES.values()):
         License.objects.create(id=license_id, title=license_id)
 
@@ -282,6 +307,61 @@ def test_no_data():
     assert resource.harvest.ods_type == 'attachment'
 
 
+def test_many_attachments(monkeypatch):
+    data = ods_dataset('with-attachments')
+    data['attachments'] = [{
+        'url': 'odsfile://file-{0}.pdf'.format(i),
+        'mimetype': 'application/pdf',
+        'id': 'file_{0}_pdf'.format(i),
+        'title': 'File {0}'.format(i),
+    } for i in range(1500)]
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+    backend = OdsBackend(source)
+    dataset = Dataset()
+
+    def get_by(*args):
+        raise AssertionError('Resources should be looked up from the index')
+
+    monkeypatch.setattr('udata_ods.harvesters.get_by', get_by)
+
+    resources = backend.index_resources(dataset)
+    backend.process_extra_files(dataset, data, 'alternative_export', resources)
+    backend.process_extra_files(dataset, data, 'attachment', resources)
+
+    assert len(dataset.resources) == 1501
+    assert len(resources) == 1501
+    existing = list(dataset.resources)
+
+    data['attachments'][42]['title'] = 'Updated'
+    backend.process_extra_files(dataset, data, 'alternative_export')
+    backend.process_extra_files(dataset, data, 'attachment')
+
+    assert list(dataset.resources) == existing
+    assert dataset.resources[43].title == 'Updated'
+
+
+def test_description_from_fields():
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+    backend = OdsBackend(source)
+    fields = [{
+        'label': 'Field {0}'.format(i),
+        'name': 'field_{0}'.format(i),
+        'type': 'text',
+        'description': 'Description {0}'.format(i) if i % 2 else None,
+    } for i in range(500)]
+
+    description = backend.description_from_fields(fields)
+
+    lines = description.splitlines()
+    assert len(lines) == 500
+    assert lines[0] == '- *Field 0*: field_0[text]'
+    assert lines[1] == '- *Field 1*: field_1[text] Description 1'
+    assert description.endswith('\n')
+    # Built once for identical fields
+    assert backend.description_from_fields([dict(f) for f in fields]) is description
+    assert backend.description_from_fields([]) is None
+
+
 @pytest.mark.frontend()
 @pytest.mark.harvest('inspire')
 def test_exclude_inspire_default():
@@ -418,3 +498,796 @@ def test_urls_format(url):
     assert explore_url == 'http://domain.com/explore/dataset/id/'
     assert download_url.startswith(explore_url)
     assert export_url.startswith(explore_url)
+
+
+@pytest.mark.frontend()
+def test_reuse_search_payloads(rmock):
+    rmock.get(SEARCH_URL, json=ods_search(*DEFAULT_SEARCH), headers=HEADERS)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'search_payloads': True}
+    })
+
+    actions.run(source.slug)
+
+    # Only the search API has been called
+    assert len(rmock.request_history) == 1
+
+    source.reload()
+    job = source.get_last_job()
+    assert len(job.items) == 4
+    assert job.status == 'done'
+    assert not any(item.kwargs for item in job.items)
+    assert Dataset.objects.count() == 3
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_PAYLOADS_MAX_SIZE=1)
+def test_reuse_search_payloads_spilled_on_disk(app, rmock, tmpdir):
+    app.config['ODS_PAYLOADS_DIR'] = str(tmpdir)
+    rmock.get(SEARCH_URL, json=ods_search(*DEFAULT_SEARCH), headers=HEADERS)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'search_payloads': True}
+    })
+
+    actions.run(source.slug)
+
+    assert len(rmock.request_history) == 1
+    source.reload()
+    assert source.get_last_job().status == 'done'
+    assert Dataset.objects.count() == 3
+    # Spilled payloads are cleaned up with the job
+    assert tmpdir.listdir() == []
+
+
+@pytest.mark.frontend()
+def test_reuse_search_payloads_fallback_on_incomplete(rmock):
+    incomplete = ods_dataset('test-a')
+    del incomplete['fields']
+    rmock.get(SEARCH_URL, json=ods_search(incomplete, 'test-b'), headers=HEADERS)
+    rmock.get(dataset_url('test-a'), json=ods_dataset('test-a'), headers=HEADERS)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'search_payloads': True}
+    })
+
+    actions.run(source.slug)
+
+    urls = [r.url.split('?')[0] for r in rmock.request_history]
+    assert urls == [SEARCH_URL, dataset_url('test-a')]
+    assert Dataset.objects.count() == 2
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_SEARCH_WORKERS=3)
+def test_concurrent_search_pages_keep_order(rmock):
+    datasets = many_datasets(237)
+    rmock.get(SEARCH_URL, json=paginated_search(datasets), headers=HEADERS)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+    backend = OdsBackend(source)
+
+    backend.perform_initialization()
+
+    starts = sorted(int(get_qs(r, 'start')) for r in rmock.request_history)
+    assert starts == [0, 50, 100, 150, 200]
+    assert [i.remote_id for i in backend.job.items] == [d['datasetid'] for d in datasets]
+
+
+@pytest.mark.frontend()
+def test_concurrent_search_pages_max_items(rmock):
+    datasets = many_datasets(237)
+    rmock.get(SEARCH_URL, json=paginated_search(datasets), headers=HEADERS)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+    backend = OdsBackend(source, max_items=60)
+
+    backend.perform_initialization()
+
+    starts = sorted(int(get_qs(r, 'start')) for r in rmock.request_history)
+    assert starts == [0, 50]
+    assert [i.remote_id for i in backend.job.items] == [d['datasetid'] for d in datasets[:60]]
+
+
+@pytest.mark.frontend()
+def test_search_rows_per_source(rmock):
+    datasets = many_datasets(237)
+    rmock.get(SEARCH_URL, json=paginated_search(datasets), headers=HEADERS)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={'rows': 100})
+    backend = OdsBackend(source)
+
+    backend.perform_initialization()
+
+    pages = sorted((int(get_qs(r, 'start')), int(get_qs(r, 'rows'))) for r in rmock.request_history)
+    assert pages == [(0, 100), (100, 100), (200, 100)]
+    assert [i.remote_id for i in backend.job.items] == [d['datasetid'] for d in datasets]
+
+
+@pytest.mark.frontend()
+def test_duplicate_listed_datasets(rmock):
+    # A dataset inserted meanwhile shifts the second page
+    datasets = many_datasets(4)
+    pages = [datasets[:2], datasets[1:3], datasets[3:]]
+
+    def search(request, context):
+        context.status_code = 200
+        return {'nhits': 5, 'datasets': pages[int(get_qs(request, 'start')) // 2]}
+
+    rmock.get(SEARCH_URL, json=search, headers=HEADERS)
+    for data in datasets:
+        rmock.get(dataset_url(data['datasetid']), json=data, headers=HEADERS)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={'rows': 2})
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert [i.remote_id for i in job.items] == [d['datasetid'] for d in datasets]
+    assert Dataset.objects.count() == 4
+
+
+@pytest.mark.parametrize('rows,expected', [
+    ('20', 20),
+    ('many', OdsBackend.SEARCH_ROWS),
+    (-5, OdsBackend.SEARCH_ROWS),
+    (None, OdsBackend.SEARCH_ROWS),
+])
+def test_search_rows_config_validation(rows, expected):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={'rows': rows})
+
+    assert OdsBackend(source).search_rows == expected
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_SEARCH_MAX_ROWS=500)
+def test_adaptive_search_rows(rmock):
+    datasets = many_datasets(1234)
+
+    def capped_search(request, context):
+        # The portal serves at most 150 datasets per page
+        start = int(get_qs(request, 'start'))
+        rows = min(int(get_qs(request, 'rows')), 150)
+        return {'nhits': len(datasets), 'datasets': datasets[start:start + rows]}
+
+    rmock.get(SEARCH_URL, json=capped_search, headers=HEADERS)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'adaptive_rows': True},
+    })
+    backend = OdsBackend(source, max_items=1000)
+
+    backend.perform_initialization()
+
+    rows = [int(get_qs(r, 'rows')) for r in rmock.request_history]
+    assert max(rows) > OdsBackend.SEARCH_ROWS
+    assert len(rows) < 1000 / OdsBackend.SEARCH_ROWS
+    assert [i.remote_id for i in backend.job.items] == [d['datasetid'] for d in datasets[:1000]]
+
+
+@pytest.mark.frontend()
+def test_catalog_export(rmock):
+    export_url = '{0}/api/explore/v2.1/catalog/exports/jsonl'.format(ODS_URL)
+    lines = [{'dataset_id': 'test-{0}'.format(i), 'metas': {'default': {'modified': 'x'}}}
+             for i in range(120)]
+    rmock.get(export_url, text=''.join(json.dumps(line) + '\n' for line in lines))
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'catalog_export': True},
+        'filters': [
+            {'key': 'tags', 'value': 'Tag'},
+            {'key': 'publisher', 'value': 'Publisher', 'type': 'exclude'},
+        ],
+    })
+    backend = OdsBackend(source, max_items=100)
+
+    backend.perform_initialization()
+
+    assert len(rmock.request_history) == 1
+    assert rmock.last_request.qs['where'] == ['keyword="tag" and not publisher="publisher"']
+    assert [i.remote_id for i in backend.job.items] == [line['dataset_id'] for line in lines[:100]]
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_PREFETCH_WORKERS=2)
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_prefetch_datasets(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert [i.remote_id for i in job.items] == list(DEFAULT_SEARCH)
+    assert [i.status for i in job.items] == ['done', 'skipped', 'done', 'done']
+    # Each dataset has been fetched exactly once
+    assert len(rmock.request_history) == 1 + len(DEFAULT_SEARCH)
+    assert Dataset.objects.count() == 3
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_BATCH_SIZE=3)
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_batch_details(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'batch_details': True},
+    })
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert [i.status for i in job.items] == ['done', 'skipped', 'done', 'done']
+    # One listing request and two batches, no dataset fetched one by one
+    assert all(r.path.endswith('/search/') for r in rmock.request_history)
+    assert len(rmock.request_history) == 3
+    assert get_qs(rmock.request_history[1], 'q') == \
+        'datasetid:"test-b" or datasetid:"test-c" or datasetid:"test-a"'
+    assert Dataset.objects.count() == 3
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_BULK_SIZE=2)
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_bulk_writes(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert [i.status for i in job.items] == ['done', 'skipped', 'done', 'done']
+    assert all(i.dataset for i in job.items if i.status == 'done')
+    assert Dataset.objects.count() == 3
+    dataset = Dataset.objects.get(harvest__remote_id='test-a')
+    assert dataset.slug
+    assert dataset.harvest.source_id == str(source.id)
+
+    ids = {d.harvest.remote_id: d.id for d in Dataset.objects}
+    actions.run(source.slug)
+
+    assert {d.harvest.remote_id: d.id for d in Dataset.objects} == ids
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_BULK_SIZE=None)
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_bulk_writes_disabled(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+
+    source.reload()
+    assert source.get_last_job().status == 'done'
+    assert Dataset.objects.count() == 3
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_BULK_SIZE=10)
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_bulk_writes_errors(rmock, monkeypatch):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+    clean = Dataset.clean
+
+    def failing_clean(self):
+        if self.harvest.remote_id == 'test-a':
+            raise ValidationError('Invalid dataset')
+        clean(self)
+
+    monkeypatch.setattr(Dataset, 'clean', failing_clean)
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done-errors'
+    assert [i.status for i in job.items] == ['done', 'skipped', 'failed', 'done']
+    assert 'Invalid dataset' in job.items[2].errors[0].message
+    assert Dataset.objects.count() == 2
+
+
+@pytest.mark.frontend()
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_local_datasets_index(rmock, monkeypatch):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+    actions.run(source.slug)
+    datasets = {d.harvest.remote_id: d for d in Dataset.objects}
+    assert len(datasets) == 3
+
+    def get_dataset(self, remote_id):
+        raise AssertionError('Datasets should be looked up from the index')
+
+    monkeypatch.setattr(OdsBackend, 'get_dataset', get_dataset)
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert job.data['ods_index']
+    for item in job.items:
+        if item.remote_id in datasets:
+            assert item.kwargs['dataset_id'] == str(datasets[item.remote_id].id)
+            assert item.kwargs['modified_at'] == datasets[item.remote_id].harvest.modified_at
+        else:
+            assert 'dataset_id' not in item.kwargs
+    assert Dataset.objects.count() == 3
+
+
+@pytest.mark.frontend()
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_licenses_cache(rmock, monkeypatch):
+    guessed = []
+    guess = License.guess.__func__
+
+    def counting_guess(cls, *strings, **kwargs):
+        guessed.append(strings)
+        return guess(cls, *strings, **kwargs)
+
+    monkeypatch.setattr(License, 'guess', classmethod(counting_guess))
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+    actions.run(source.slug)
+
+    # Each distinct ODS license string is resolved once
+    assert guessed
+    assert len(guessed) == len(set(guessed))
+    assert Dataset.objects.get(harvest__remote_id='test-a').license.id == 'fr-lo'
+
+
+@pytest.mark.frontend()
+def test_descriptions_conversion(rmock, monkeypatch):
+    converted = []
+    html_to_markdown.cache_clear()
+    monkeypatch.setattr('udata_ods.harvesters.parse_html',
+                        lambda html: converted.append(html) or html.upper())
+    datasets = many_datasets(3)
+
+    def mock_datasets():
+        for data in datasets:
+            rmock.get(dataset_url(data['datasetid']), json=data, headers=HEADERS)
+        rmock.get(SEARCH_URL, headers=HEADERS, json=ods_search(*datasets))
+
+    mock_datasets()
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+
+    # The same description is only converted once
+    assert converted == ['<p>test-a-description</p>']
+    assert [d.description for d in Dataset.objects] == ['<P>TEST-A-DESCRIPTION</P>'] * 3
+
+    # Unchanged descriptions are not converted again
+    html_to_markdown.cache_clear()
+    actions.run(source.slug)
+    assert len(converted) == 1
+
+    datasets[1]['metas']['description'] = 'updated'
+    mock_datasets()
+    actions.run(source.slug)
+
+    assert converted == ['<p>test-a-description</p>', 'updated']
+    assert Dataset.objects.get(harvest__remote_id='test-a-1').description == 'UPDATED'
+
+
+@pytest.mark.frontend()
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_incremental_harvest(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'incremental': True}
+    })
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert [i.status for i in job.items] == ['done', 'skipped', 'done', 'done']
+    assert Dataset.objects.count() == 3
+
+    rmock.reset_mock()
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert [i.status for i in job.items] == ['skipped'] * 4
+    unchanged = [i for i in job.items if 'not been modified' in i.errors[0].message]
+    assert [i.remote_id for i in unchanged] == ['test-b', 'test-a', 'test-shp-limit']
+    # Unchanged datasets have not been fetched
+    assert [r.url.split('?')[0] for r in rmock.request_history] == [
+        SEARCH_URL, dataset_url('test-c')
+    ]
+
+    modified = ods_dataset('test-a')
+    modified['metas']['modified'] = '2015-05-01T10:00:00+00:00'
+    modified['metas']['title'] = 'new title'
+    rmock.get(SEARCH_URL, json=ods_search('test-b', modified), headers=HEADERS)
+    rmock.get(dataset_url('test-a'), json=modified, headers=HEADERS)
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert [i.status for i in job.items] == ['skipped', 'done']
+    dataset = Dataset.objects.get(harvest__remote_id='test-a')
+    assert dataset.title == 'new title'
+
+
+@pytest.mark.frontend()
+@pytest.mark.parametrize('options,features', [
+    ({'ODS_PREFETCH_WORKERS': 2}, {}),
+    ({'ODS_BATCH_SIZE': 3}, {'batch_details': True}),
+])
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_incremental_harvest_prefetch(app, rmock, options, features):
+    app.config.update(options)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': dict(features, incremental=True)
+    })
+    actions.run(source.slug)
+    rmock.reset_mock()
+
+    backend = OdsBackend(source)
+    backend.perform_initialization()
+    backend.process_items()
+
+    assert [i.status for i in backend.job.items] == ['skipped'] * 4
+    # Unchanged datasets have not been prefetched, only the one without record
+    assert len(rmock.request_history) == 2
+    assert 'test-c' in rmock.last_request.url
+    assert backend.prefetched == {}
+
+
+@pytest.mark.frontend()
+@pytest.mark.harvest('test-a')
+def test_delta_harvest(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'delta': True}
+    })
+    started = datetime.utcnow() - timedelta(days=2)
+    HarvestJobFactory(source=source, status='done', started=started)
+    # Failed jobs are ignored
+    HarvestJobFactory(source=source, status='failed', started=datetime.utcnow())
+
+    actions.run(source.slug)
+
+    since = (started - timedelta(days=1)).date().isoformat()
+    assert get_qs(rmock.request_history[0], 'q') == 'modified>={0}'.format(since)
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert job.data['ods_delta'] == since
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_FULL_HARVEST_DAYS=3)
+@pytest.mark.harvest('test-a')
+def test_delta_harvest_periodic_full_harvest(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'delta': True}
+    })
+    HarvestJobFactory(source=source, status='done', started=datetime.utcnow() - timedelta(days=4))
+    HarvestJobFactory(source=source, status='done', started=datetime.utcnow() - timedelta(days=1),
+                      data={'ods_delta': '2024-01-01'})
+
+    actions.run(source.slug)
+
+    # Last full harvest is too old
+    assert 'q' not in rmock.request_history[0].qs
+    source.reload()
+    assert 'ods_delta' not in source.get_last_job().data
+
+
+@pytest.mark.frontend()
+@pytest.mark.harvest('test-a')
+def test_delta_harvest_first_run_is_full(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'delta': True}
+    })
+
+    actions.run(source.slug)
+
+    assert 'q' not in rmock.request_history[0].qs
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_BACKOFF=0)
+def test_throttled_search_is_retried(rmock):
+    rmock.get(SEARCH_URL, [
+        {'status_code': 429, 'headers': {'Retry-After': '0'}},
+        {'json': ods_search('test-a'), 'headers': HEADERS},
+    ])
+    rmock.get(dataset_url('test-a'), json=ods_dataset('test-a'), headers=HEADERS)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert job.data['ods_stats']['requests'] == 3
+    assert job.data['ods_stats']['retries'] == 1
+    assert job.data['ods_stats']['bytes'] > 0
+
+
+@pytest.mark.frontend()
+def test_conditional_requests_cache(app, cli, rmock, tmpdir):
+    app.config['ODS_CACHE_DIR'] = str(tmpdir)
+    etag = {'ETag': '"v1"'}
+    etag.update(HEADERS)
+
+    def dataset(request, context):
+        if request.headers.get('If-None-Match') == '"v1"':
+            context.status_code = 304
+            return None
+        context.headers.update(etag)
+        return ods_dataset('test-a')
+
+    rmock.get(SEARCH_URL, json=ods_search('test-a'), headers=HEADERS)
+    rmock.get(dataset_url('test-a'), json=dataset)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+    actions.run(source.slug)
+
+    assert 'If-None-Match' not in rmock.request_history[1].headers
+    assert rmock.request_history[3].headers['If-None-Match'] == '"v1"'
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert job.items[0].status == 'done'
+    assert job.data['ods_stats']['cache_hits'] == 1
+    assert Dataset.objects.get(harvest__remote_id='test-a').title == 'test-a'
+
+    cli('ods purge-cache {0}'.format(source.slug))
+    rmock.reset_mock()
+    actions.run(source.slug)
+
+    assert 'If-None-Match' not in rmock.request_history[1].headers
+
+
+@pytest.mark.frontend()
+@pytest.mark.parametrize('catalog_export', [False, True])
+def test_streamed_responses_not_cached(app, rmock, tmpdir, catalog_export):
+    app.config['ODS_CACHE_DIR'] = str(tmpdir)
+    headers = {'ETag': '"v1"'}
+    headers.update(HEADERS)
+    rmock.get(SEARCH_URL, json=ods_search('test-a'), headers=headers)
+    line = json.dumps({'dataset_id': 'test-a', 'metas': {'default': {}}})
+    rmock.get('{0}/api/explore/v2.1/catalog/exports/jsonl'.format(ODS_URL),
+              text=line, headers=headers)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'features': {'catalog_export': catalog_export},
+    })
+
+    OdsBackend(source).perform_initialization()
+    backend = OdsBackend(source)
+    backend.perform_initialization()
+
+    assert len(rmock.request_history) == 2
+    assert 'If-None-Match' not in rmock.last_request.headers
+    assert [i.remote_id for i in backend.job.items] == ['test-a']
+    assert backend.cache.size == 0
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_CIRCUIT_THRESHOLD=2, ODS_MAX_RETRIES=0)
+def test_unreachable_portal_fails_fast(rmock):
+    rmock.get(SEARCH_URL, json=ods_search(*DEFAULT_SEARCH), headers=HEADERS)
+    for id in DEFAULT_SEARCH:
+        rmock.get(dataset_url(id), exc=requests.ConnectTimeout)
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+
+    # Two failed requests opened the circuit
+    assert rmock.call_count == 3
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done-errors'
+    assert all(i.status == 'failed' for i in job.items)
+    assert 'unreachable' in job.items[-1].errors[0].message
+    assert job.data['ods_circuit'] == 'open'
+    assert job.data['ods_stats']['circuit_trips'] == 1
+    assert job.data['ods_stats']['circuit_rejected'] == 2
+
+
+METRICS = []
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_TIMINGS=True,
+                     ODS_METRICS_HOOK=lambda stage, elapsed, tags: METRICS.append((stage, tags)))
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_stages_timings(rmock):
+    del METRICS[:]
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    timings = job.data['ods_timings']
+    assert timings['search']['count'] == 1
+    assert timings['fetch']['count'] == timings['decode']['count'] == 4
+    assert timings['item']['count'] == 4
+    # The dataset without record is skipped before being built and saved
+    for stage in 'description', 'tags', 'license', 'resources', 'save':
+        assert timings[stage]['count'] == 3
+    for stage in timings.values():
+        assert stage['max'] <= stage['total']
+        assert sum(v for k, v in stage.items() if k[:3] in ('le_', 'gt_')) == stage['count']
+    assert len(METRICS) == sum(stage['count'] for stage in timings.values())
+    assert METRICS[0][1] == {'domain': DOMAIN, 'source': source.slug}
+
+
+@pytest.mark.frontend()
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_stages_timings_disabled(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+
+    source.reload()
+    assert 'ods_timings' not in source.get_last_job().data
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_PROFILE_RATE=1, ODS_PROFILE_MAX_REPORTS=3)
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_items_profiling(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    profiles = job.data['ods_profiles']
+    assert len(profiles) == 3
+    assert [p['seconds'] for p in profiles] == sorted((p['seconds'] for p in profiles),
+                                                      reverse=True)
+    assert {p['remote_id'] for p in profiles} <= {i.remote_id for i in job.items}
+    assert all(p['status'] in ('done', 'skipped') and p['functions'] for p in profiles)
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_PROFILE_THRESHOLD=60)
+@pytest.mark.harvest(*DEFAULT_SEARCH)
+def test_items_profiling_threshold(rmock):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL)
+
+    actions.run(source.slug)
+
+    source.reload()
+    assert 'ods_profiles' not in source.get_last_job().data
+
+
+def dated_datasets(count):
+    '''Generate `count` ODS datasets, each modified a day after the previous one'''
+    datasets = many_datasets(count)
+    for i, data in enumerate(datasets):
+        data['metas']['modified'] = '2020-01-{0:02d}T00:00:00+00:00'.format(i + 1)
+    return datasets
+
+
+@pytest.mark.frontend()
+def test_time_budget_prioritize(rmock):
+    datasets = dated_datasets(5)
+    for data in datasets:
+        rmock.get(dataset_url(data['datasetid']), json=data, headers=HEADERS)
+    rmock.get(SEARCH_URL, headers=HEADERS, json=ods_search(*datasets))
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={'time_budget': 3600})
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert [i.remote_id for i in job.items] == ['test-a-{0}'.format(i) for i in range(4, -1, -1)]
+    assert all(i.status == 'done' for i in job.items)
+    assert 'ods_postponed' not in job.data
+
+
+@pytest.mark.frontend()
+def test_time_budget_postpone(rmock, monkeypatch):
+    datasets = dated_datasets(5)
+    for data in datasets:
+        rmock.get(dataset_url(data['datasetid']), json=data, headers=HEADERS)
+    rmock.get(SEARCH_URL, headers=HEADERS, json=ods_search(*datasets))
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={'time_budget': 3600})
+    processed = []
+    process = OdsBackend.process
+
+    def counting_process(self, item):
+        processed.append(item.remote_id)
+        return process(self, item)
+
+    monkeypatch.setattr(OdsBackend, 'process', counting_process)
+    # The budget runs out after 2 items
+    monkeypatch.setattr(OdsBackend, 'out_of_time', lambda self: len(processed) >= 2)
+
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert processed == ['test-a-4', 'test-a-3']
+    assert [i.status for i in job.items] == ['done', 'done', 'skipped', 'skipped', 'skipped']
+    assert 'postponed' in job.items[-1].errors[0].message
+    assert job.data['ods_postponed'] == ['test-a-2', 'test-a-1', 'test-a-0']
+    assert Dataset.objects.count() == 2
+
+    # Postponed items are processed first, up to date ones last
+    del processed[:]
+    datasets[0]['metas']['modified'] = '2021-01-01T00:00:00+00:00'
+    rmock.get(SEARCH_URL, headers=HEADERS, json=ods_search(*datasets))
+    monkeypatch.setattr(OdsBackend, 'out_of_time', lambda self: False)
+    actions.run(source.slug)
+
+    source.reload()
+    job = source.get_last_job()
+    assert processed == ['test-a-2', 'test-a-1', 'test-a-0', 'test-a-4', 'test-a-3']
+    assert all(i.status == 'done' for i in job.items)
+    assert Dataset.objects.count() == 5
+
+
+@pytest.mark.frontend()
+@pytest.mark.parametrize('delta', [False, True])
+def test_time_budget_carried_over_unlisted(rmock, delta):
+    rmock.get(SEARCH_URL, headers=HEADERS, json=ods_search(*dated_datasets(2)))
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={
+        'time_budget': 3600,
+        'features': {'delta': delta},
+    })
+    HarvestJobFactory(source=source, status='done', started=datetime.utcnow() - timedelta(hours=1),
+                      data={'ods_postponed': ['test-a-0', 'removed']})
+    backend = OdsBackend(source)
+
+    backend.perform_initialization()
+
+    remote_ids = [i.remote_id for i in backend.job.items]
+    # Only delta harvests may not list a postponed dataset which still exists
+    if delta:
+        assert remote_ids == ['test-a-0', 'removed', 'test-a-1']
+    else:
+        assert remote_ids == ['test-a-0', 'test-a-1']
+
+
+@pytest.mark.frontend()
+@pytest.mark.options(ODS_PREFETCH_WORKERS=2)
+def test_time_budget_postpone_prefetched(rmock, monkeypatch):
+    datasets = dated_datasets(5)
+    for data in datasets:
+        rmock.get(dataset_url(data['datasetid']), json=data, headers=HEADERS)
+    rmock.get(SEARCH_URL, headers=HEADERS, json=ods_search(*datasets))
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={'time_budget': 3600})
+    backend = OdsBackend(source)
+    monkeypatch.setattr(OdsBackend, 'out_of_time',
+                        lambda self: any(i.status == 'done' for i in self.job.items))
+
+    backend.perform_initialization()
+    backend.process_items()
+
+    assert [i.status for i in backend.job.items] == ['done'] + ['skipped'] * 4
+    # Prefetched datasets of postponed items have been released
+    assert backend.prefetched == {}
+
+
+@pytest.mark.frontend()
+def test_time_budget_carried_over_failed_job(rmock):
+    rmock.get(SEARCH_URL, headers=HEADERS, json=ods_search(*dated_datasets(2)))
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={'time_budget': 3600})
+    HarvestJobFactory(source=source, status='done', started=datetime.utcnow() - timedelta(hours=2),
+                      data={'ods_postponed': ['test-a-0']})
+    # Failed during its initialization
+    HarvestJobFactory(source=source, status='failed',
+                      started=datetime.utcnow() - timedelta(hours=1), data={})
+    backend = OdsBackend(source)
+
+    backend.perform_initialization()
+
+    assert [i.remote_id for i in backend.job.items] == ['test-a-0', 'test-a-1']
+
+
+@pytest.mark.parametrize('time_budget,expected', [('60', 60), ('soon', None), (0, None)])
+def test_time_budget_config_validation(time_budget, expected):
+    source = HarvestSourceFactory(backend='ods', url=ODS_URL, config={'time_budget': time_budget})
+
+    assert OdsBackend(source).time_budget == expected
@@ -0,0 +1,135 @@
+import pytest
+import requests
+
+from udata_ods import breaker as breaker_module
+from udata_ods.breaker import CircuitBreaker, CircuitOpenError, get_breaker
+from udata_ods.transport import Transport
+
+URL = 'http://example.com/api/datasets/1.0/test-a/'
+
+
+@pytest.fixture
+def now(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(breaker_module.time, 'time', lambda: clock[0])
+    return clock
+
+
+def test_open_after_consecutive_failures(now):
+    breaker = CircuitBreaker('example.com', threshold=3)
+
+    assert not breaker.failure()
+    assert not breaker.failure()
+    breaker.success()
+    assert not breaker.failure()
+    assert not breaker.failure()
+    assert breaker.failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 1
+    with pytest.raises(CircuitOpenError, match='example.com is unreachable'):
+        breaker.before_request()
+
+
+def test_half_open_probe_success(now):
+    breaker = CircuitBreaker('example.com', threshold=1, reset_timeout=60)
+    breaker.failure()
+
+    now[0] += 60
+    breaker.before_request()
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_request()
+
+
+def test_half_open_probe_failure(now):
+    breaker = CircuitBreaker('example.com', threshold=5, reset_timeout=60)
+    for _ in range(5):
+        breaker.failure()
+
+    now[0] += 60
+    breaker.before_request()
+
+    assert breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_transport_fails_fast(rmock, now, monkeypatch):
+    monkeypatch.setattr('udata_ods.transport.time.sleep', lambda delay: None)
+    rmock.get(URL, exc=requests.ConnectTimeout)
+    breaker = CircuitBreaker('example.com', threshold=3)
+    transport = Transport(max_retries=5)
+    stats = {}
+
+    with pytest.raises(CircuitOpenError):
+        transport.get(URL, stats=stats, breaker=breaker)
+    assert rmock.call_count == 3
+
+    with pytest.raises(CircuitOpenError):
+        transport.get(URL, stats=stats, breaker=breaker)
+    assert rmock.call_count == 3
+    assert stats['circuit_trips'] == 1
+    assert stats['circuit_rejected'] == 2
+
+
+@pytest.mark.parametrize('exc', [requests.exceptions.ChunkedEncodingError,
+                                 requests.exceptions.InvalidURL])
+def test_transport_probe_unexpected_error(rmock, now, exc):
+    breaker = CircuitBreaker('example.com', threshold=1, reset_timeout=60)
+    breaker.failure()
+    now[0] += 60
+    rmock.get(URL, [{'exc': exc}, {'json': {}}])
+
+    with pytest.raises(exc):
+        Transport(max_retries=0).get(URL, breaker=breaker)
+
+    # The probe has been released without counting as a connection failure
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.trips == 1
+    assert Transport(max_retries=0).get(URL, breaker=breaker).ok
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_transport_unexpected_errors_do_not_open(rmock):
+    breaker = CircuitBreaker('example.com', threshold=1)
+    rmock.get(URL, exc=requests.exceptions.InvalidURL)
+
+    with pytest.raises(requests.exceptions.InvalidURL):
+        Transport(max_retries=0).get(URL, breaker=breaker)
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def test_transport_limiter_error_releases_probe(rmock, now):
+    class BrokenLimiter(object):
+        def acquire(self):
+            raise RuntimeError('Limiter unavailable')
+
+    breaker = CircuitBreaker('example.com', threshold=1, reset_timeout=60)
+    breaker.failure()
+    now[0] += 60
+    rmock.get(URL, json={})
+
+    with pytest.raises(RuntimeError):
+        Transport().get(URL, breaker=breaker, limiter=BrokenLimiter())
+
+    assert rmock.call_count == 0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert Transport().get(URL, breaker=breaker).ok
+
+
+def test_breakers_by_domain():
+    breaker = get_breaker('example.com')
+
+    assert get_breaker('example.com') is breaker
+    assert get_breaker('other.com') is not breaker
@@ -0,0 +1,47 @@
+import pytest
+
+from udata.core.dataset.factories import DatasetFactory
+from udata.models import Dataset
+
+from udata_ods.bulk import BulkWriter
+
+
+class Outcomes(dict):
+    def callback(self, name):
+        return lambda error: self.__setitem__(name, error)
+
+
+@pytest.mark.usefixtures('clean_db')
+def test_bulk_upserts():
+    existing = DatasetFactory(title='Existing')
+    existing.description = 'updated'
+    outcomes = Outcomes()
+    writer = BulkWriter(Dataset, 3)
+
+    writer.add(existing, outcomes.callback('existing'))
+    writer.add(Dataset(title='New'), outcomes.callback('new'))
+    assert Dataset.objects.count() == 1
+    writer.add(Dataset(title='Invalid', frequency='not-a-frequency'), outcomes.callback('invalid'))
+
+    assert not writer.pending
+    assert outcomes['existing'] is None
+    assert outcomes['new'] is None
+    assert outcomes['invalid'] is not None
+    assert Dataset.objects.count() == 2
+    assert Dataset.objects.get(id=existing.id).description == 'updated'
+    assert Dataset.objects.get(title='New').slug == 'new'
+
+
+@pytest.mark.usefixtures('clean_db')
+def test_bulk_unique_slugs():
+    outcomes = Outcomes()
+    writer = BulkWriter(Dataset, 10)
+
+    for index in range(3):
+        writer.add(Dataset(title='Same title'), outcomes.callback(index))
+    writer.flush()
+
+    assert outcomes == {0: None, 1: None, 2: None}
+    assert sorted(d.slug for d in Dataset.objects) == [
+        'same-title', 'same-title-1', 'same-title-2'
+    ]
@@ -0,0 +1,120 @@
+import sqlite3
+
+import pytest
+import requests
+
+from udata_ods.cache import ResponseCache, get_cache
+
+URL = 'http://example.com/api/datasets/1.0/test-a/'
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return ResponseCache(str(tmpdir.join('responses.sqlite')), max_size=1024)
+
+
+def response(rmock, content=b'{}', url=URL, **headers):
+    rmock.get(url, content=content, headers=headers)
+    return requests.get(url)
+
+
+def test_store_and_get(rmock, cache):
+    key = cache.key(URL)
+    r = response(rmock, b'{"datasetid": "test-a"}', ETag='"abc"',
+                 **{'Content-Type': 'application/json', 'Last-Modified': 'Wed, 21 Oct 2015'})
+
+    assert cache.set(key, 'source', r)
+
+    entry = cache.get(key)
+    assert entry.conditional_headers == {
+        'If-None-Match': '"abc"',
+        'If-Modified-Since': 'Wed, 21 Oct 2015',
+    }
+    cached = entry.to_response()
+    assert cached.status_code == 200
+    assert cached.json() == {'datasetid': 'test-a'}
+    assert cached.headers['content-type'] == 'application/json'
+    # Cached responses may be read as streamed ones
+    with entry.to_response() as streamed:
+        assert b''.join(streamed.iter_content(4)) == b'{"datasetid": "test-a"}'
+
+
+def test_do_not_store_without_validators(rmock, cache):
+    key = cache.key(URL)
+
+    assert not cache.set(key, 'source', response(rmock))
+    assert cache.get(key) is None
+
+
+def test_key_depends_on_params():
+    key = ResponseCache.key(URL, {'start': 0, 'refine.keyword': {'b', 'a'}})
+
+    assert key == ResponseCache.key(URL, {'refine.keyword': ['a', 'b'], 'start': 0})
+    assert key != ResponseCache.key(URL, {'start': 50, 'refine.keyword': {'b', 'a'}})
+    assert key != ResponseCache.key(URL)
+    assert ResponseCache.key(URL, source='a') != ResponseCache.key(URL, source='b')
+
+
+def test_evict_least_recently_used(rmock, cache):
+    keys = []
+    for i in range(3):
+        url = '{0}{1}/'.format(URL, i)
+        keys.append(cache.key(url))
+        cache.set(keys[-1], 'source', response(rmock, b'x' * 400, url, ETag=str(i)))
+        # Mark the first entry as recently used
+        cache.get(keys[0])
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+    assert cache.size == 800
+
+
+def test_purge_by_source(rmock, cache):
+    first, second = cache.key(URL, {'a': 1}), cache.key(URL, {'a': 2})
+    cache.set(first, 'first', response(rmock, ETag='1'))
+    cache.set(second, 'second', response(rmock, ETag='2'))
+
+    assert cache.purge('first') == 1
+    assert cache.get(first) is None
+    assert cache.get(second) is not None
+
+    assert cache.purge() == 1
+    assert cache.get(second) is None
+
+
+def test_sources_sharing_urls(rmock, cache):
+    cache.set(cache.key(URL, source='first'), 'first', response(rmock, ETag='1'))
+    cache.set(cache.key(URL, source='second'), 'second', response(rmock, ETag='2'))
+
+    assert cache.purge('first') == 1
+    assert cache.get(cache.key(URL, source='second')) is not None
+
+
+def test_size_tracking(rmock, cache):
+    key = cache.key(URL)
+    cache.set(key, 'source', response(rmock, b'x' * 100, ETag='1'))
+    cache.set(key, 'source', response(rmock, b'x' * 300, ETag='2'))
+
+    assert cache.size == 300
+    cache.purge()
+    assert cache.size == 0
+
+
+def test_size_of_existing_cache(tmpdir):
+    path = str(tmpdir.join('responses.sqlite'))
+    with sqlite3.connect(path) as db:
+        db.execute('CREATE TABLE responses (key TEXT PRIMARY KEY, source TEXT, url TEXT, '
+                   'etag TEXT, last_modified TEXT, headers TEXT, content BLOB, size INTEGER, '
+                   'accessed REAL)')
+        db.execute("INSERT INTO responses VALUES ('k', 's', 'u', 'e', NULL, '{}', 'xx', 2, 0)")
+    db.close()
+
+    assert ResponseCache(path, max_size=1024).size == 2
+
+
+def test_cache_shared_by_directory(tmpdir):
+    cache = get_cache(str(tmpdir), 10)
+
+    assert get_cache(str(tmpdir), 20) is cache
+    assert cache.max_size == 20
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from dateutil.parser import parse as dateutil_parse
+
+from udata_ods.dates import parse_date, parse_iso_date
+
+
+@pytest.mark.parametrize('value', [
+    '2015-04-09T10:28:45+00:00',
+    '2015-04-09T10:28:45Z',
+    '2015-04-09T10:28:45.123456789Z',
+    '2015-04-09T10:28:45.1',
+    '2015-04-09T10:28:45+0200',
+    '2015-04-09T10:28:45-05:30',
+    '2015-04-09 10:28',
+    '2015-04-09',
+    'April 9, 2015',
+])
+def test_parse_date_as_dateutil(value):
+    assert parse_date(value) == dateutil_parse(value)
+
+
+def test_iso_fast_path():
+    assert parse_iso_date('2015-04-09T10:28:45+02:00') == datetime(
+        2015, 4, 9, 10, 28, 45, tzinfo=timezone(timedelta(hours=2)))
+    assert parse_iso_date('April 9, 2015') is None
+
+
+@pytest.mark.parametrize('value', ['2015-02-30T10:00:00', '2015-04-09T24:00:00', 'not a date'])
+def test_invalid_dates(value):
+    with pytest.raises(ValueError):
+        parse_date(value)
@@ -0,0 +1,30 @@
+import pytest
+
+from udata_ods.formats import guess_format, guess_mimetype
+
+
+@pytest.mark.parametrize('mimetype,url,expected', [
+    ('text/csv', None, 'csv'),
+    ('TEXT/CSV', None, 'csv'),
+    ('application/pdf', 'http://somewhere.com/file.zip', 'pdf'),
+    ('application/vnd.geo+json', None, 'geojson'),
+    ('application/x-unknown', 'http://somewhere.com/file.xlsx', 'xlsx'),
+    ('application/x-unknown', 'http://somewhere.com/file', None),
+    (None, 'http://somewhere.com/file.json', 'json'),
+    (None, None, None),
+])
+def test_guess_format(mimetype, url, expected):
+    assert guess_format(mimetype, url) == expected
+
+
+@pytest.mark.parametrize('mimetype,url,expected', [
+    ('text/csv', None, 'text/csv'),
+    ('Text/CSV', None, 'text/csv'),
+    ('application/vnd.geo+json', None, 'application/vnd.geo+json'),
+    ('application/x-unknown', 'http://somewhere.com/file.pdf', 'application/pdf'),
+    ('application/x-unknown', 'http://somewhere.com/file', None),
+    ('application/x-unknown', None, None),
+    (None, 'http://somewhere.com/file.csv', 'text/csv'),
+])
+def test_guess_mimetype(mimetype, url, expected):
+    assert guess_mimetype(mimetype, url) == expected
@@ -0,0 +1,64 @@
+import pytest
+
+from udata_ods import licenses as licenses_module
+from udata_ods.licenses import LicenseCache, get_license_cache
+
+
+@pytest.fixture
+def now(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(licenses_module.time, 'time', lambda: clock[0])
+    return clock
+
+
+def test_resolve_once_until_expired(now):
+    cache = LicenseCache(ttl=60)
+    resolved = []
+
+    def resolve():
+        resolved.append(True)
+        return 'fr-lo'
+
+    assert cache.get('Licence Ouverte', resolve) == 'fr-lo'
+    now[0] += 59
+    assert cache.get('Licence Ouverte', resolve) == 'fr-lo'
+    assert len(resolved) == 1
+
+    now[0] += 1
+    assert cache.get('Licence Ouverte', resolve) == 'fr-lo'
+    assert len(resolved) == 2
+
+
+def test_cache_missing_licenses(now):
+    cache = LicenseCache()
+    resolved = []
+
+    def resolve():
+        resolved.append(True)
+
+    assert cache.get(None, resolve) is None
+    assert cache.get(None, resolve) is None
+    assert len(resolved) == 1
+
+
+def test_disabled(now):
+    cache = LicenseCache(ttl=0)
+    resolved = []
+
+    cache.get('key', lambda: resolved.append(True))
+    cache.get('key', lambda: resolved.append(True))
+
+    assert len(resolved) == 2
+
+
+def test_clear(now):
+    cache = LicenseCache()
+    cache.get('key', lambda: 'first')
+    cache.clear()
+
+    assert cache.get('key', lambda: 'second') == 'second'
+
+
+def test_caches_by_ttl():
+    assert get_license_cache(300) is get_license_cache(300)
+    assert get_license_cache(300) is not get_license_cache(60)
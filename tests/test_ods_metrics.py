@@ -0,0 +1,61 @@
+import pytest
+
+from udata_ods import metrics as metrics_module
+from udata_ods.metrics import StageTimings, merge_timings
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(metrics_module.time, 'perf_counter', lambda: now[0])
+    return now
+
+
+def test_aggregate_stages(clock):
+    timings = StageTimings()
+
+    for elapsed in (0.005, 0.5, 20):
+        with timings.stage('fetch'):
+            clock[0] += elapsed
+    timings.observe('save', 0.0005)
+
+    assert timings.drain() == {
+        'fetch': {'count': 3, 'total': 20.505, 'max': 20, 'le_10ms': 1, 'le_1s': 1, 'gt_10s': 1},
+        'save': {'count': 1, 'total': 0.0005, 'max': 0.0005, 'le_1ms': 1},
+    }
+    assert timings.drain() == {}
+
+
+def test_measure_failing_stages(clock):
+    timings = StageTimings()
+
+    with pytest.raises(ValueError):
+        with timings.stage('decode'):
+            clock[0] += 1
+            raise ValueError()
+
+    assert timings.drain()['decode']['count'] == 1
+
+
+def test_hook(clock):
+    measures = []
+    timings = StageTimings(lambda *args: measures.append(args), {'domain': 'example.com'})
+
+    with timings.stage('fetch'):
+        clock[0] += 2
+
+    assert measures == [('fetch', 2, {'domain': 'example.com'})]
+
+
+def test_merge_timings():
+    target = {'fetch': {'count': 1, 'total': 2, 'max': 2, 'le_10s': 1}}
+
+    merge_timings(target, {
+        'fetch': {'count': 2, 'total': 1.5, 'max': 1, 'le_1s': 2},
+        'save': {'count': 1, 'total': 0.5, 'max': 0.5, 'le_1s': 1},
+    })
+
+    assert target == {
+        'fetch': {'count': 3, 'total': 3.5, 'max': 2, 'le_10s': 1, 'le_1s': 2},
+        'save': {'count': 1, 'total': 0.5, 'max': 0.5, 'le_1s': 1},
+    }
@@ -0,0 +1,79 @@
+import pytest
+
+from udata_ods.profiling import ItemProfiler, merge_profiles
+
+
+def busy():
+    return sum(i * i for i in range(10000))
+
+
+def allocate():
+    return [str(i) for i in range(10000)]
+
+
+@pytest.mark.parametrize('rate,threshold,expected', [
+    (0, None, False),
+    (1, None, True),
+    (0, 10, True),
+])
+def test_sampled(rate, threshold, expected):
+    assert ItemProfiler(rate, threshold).sampled() is expected
+
+
+def test_report_hotspots():
+    reports = []
+    profiler = ItemProfiler(rate=1, top=3)
+
+    with profiler.profile(reports, remote_id='slow') as infos:
+        busy()
+        infos['status'] = 'done'
+
+    report, = reports
+    assert report['remote_id'] == 'slow'
+    assert report['status'] == 'done'
+    assert report['seconds'] > 0
+    assert len(report['functions']) == 3
+    assert any('test_ods_profiling.py' in f['function'] and '(<genexpr>)' in f['function']
+               for f in report['functions'])
+    assert 'allocations' not in report
+
+
+def test_report_allocations():
+    reports = []
+    profiler = ItemProfiler(rate=1, memory=True, top=2)
+
+    with profiler.profile(reports):
+        data = allocate()  # noqa: F841
+
+    allocations = reports[0]['allocations']
+    assert len(allocations) == 2
+    assert allocations[0]['line'].startswith('tests/test_ods_profiling.py:')
+    assert allocations[0]['size'] > 0
+
+
+def test_threshold():
+    reports = []
+    profiler = ItemProfiler(threshold=60)
+
+    with profiler.profile(reports, remote_id='fast'):
+        busy()
+
+    assert reports == []
+
+
+def test_profile_failures():
+    reports = []
+
+    with pytest.raises(ValueError):
+        with ItemProfiler(rate=1).profile(reports):
+            raise ValueError()
+
+    assert len(reports) == 1
+
+
+def test_merge_profiles():
+    profiles = [{'seconds': 3}, {'seconds': 1}]
+
+    merge_profiles(profiles, [{'seconds': 2}, {'seconds': 4}], 3)
+
+    assert profiles == [{'seconds': 4}, {'seconds': 3}, {'seconds': 2}]
@@ -0,0 +1,108 @@
+import pytest
+
+from udata_ods import ratelimit
+from udata_ods.ratelimit import SharedTokenBucket, TokenBucket, get_limiter
+from udata_ods.transport import Transport
+
+URL = 'http://example.com/api/datasets/1.0/search/'
+
+
+class Clock(object):
+    '''A fake clock whose `sleep` moves time forward'''
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'time', clock.time)
+    monkeypatch.setattr(ratelimit.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    waits = [bucket.acquire() for _ in range(5)]
+
+    assert waits == [0, 0, 0, 0.5, 0.5]
+
+
+def test_refill_over_time(clock):
+    bucket = TokenBucket(rate=2, burst=2)
+    for _ in range(2):
+        bucket.acquire()
+
+    clock.now += 10
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0.5
+
+
+def test_adaptive_slow_down(clock):
+    bucket = TokenBucket(rate=4, burst=1)
+    bucket.acquire()
+
+    bucket.throttled()
+    assert bucket.acquire() == 0.25
+    assert bucket.acquire() == 0.5
+
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.factor == 1.0
+
+
+def test_slow_down_is_bounded(clock):
+    bucket = TokenBucket(rate=1)
+    for _ in range(20):
+        bucket.throttled()
+
+    assert bucket.factor == TokenBucket.MIN_FACTOR
+
+
+def test_transport_rate_limited(rmock, clock):
+    rmock.get(URL, [{'status_code': 429}, {'json': {}}, {'json': {}}])
+    bucket = TokenBucket(rate=1, burst=1)
+    transport = Transport(backoff=0)
+    stats = {}
+
+    transport.get(URL, stats=stats, limiter=bucket)
+    transport.get(URL, stats=stats, limiter=bucket)
+
+    assert rmock.call_count == 3
+    # Retry waits for the next slot (1s), then the rate has been halved (2s)
+    assert stats['rate_limit_wait'] == 3
+
+
+def test_limiters_by_domain():
+    limiter = get_limiter('example.com', 1)
+
+    assert get_limiter('example.com', 1) is limiter
+    assert get_limiter('other.com', 1) is not limiter
+    assert isinstance(get_limiter('example.com', 1, shared=True), SharedTokenBucket)
+
+
+@pytest.mark.usefixtures('clean_db')
+def test_shared_bucket(clock):
+    first = SharedTokenBucket('example.com', rate=2, burst=2)
+    second = SharedTokenBucket('example.com', rate=2, burst=2)
+
+    assert first.acquire() == 0
+    assert second.acquire() == 0
+    assert first.acquire() == 0.5
+
+    second.throttled()
+    # Burst tolerance is now a single 1s interval
+    assert first.acquire() == 0
+    assert first.acquire() == 1
+    assert first.factor == 0.5
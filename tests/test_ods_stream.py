@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from udata_ods.stream import JSONObjectStream, iter_json_lines
+
+DOCUMENT = {
+    'nhits': 3,
+    'parameters': {'rows': 50, 'interopmetas': True},
+    'datasets': [
+        {'datasetid': 'été', 'metas': {'title': 'Données ☃', 'records_count': 1234567}},
+        {'datasetid': 'b', 'metas': {}},
+        {'datasetid': 'c', 'fields': [1.5, -2e3, None, True]},
+    ],
+}
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 100000])
+def test_decode_whatever_the_chunks_boundaries(size):
+    data = json.dumps(DOCUMENT, ensure_ascii=False, indent=2).encode('utf-8')
+
+    members = list(JSONObjectStream(chunked(data, size), 'datasets'))
+
+    assert members == [
+        ('nhits', 3),
+        ('parameters', DOCUMENT['parameters']),
+    ] + [('datasets', dataset) for dataset in DOCUMENT['datasets']]
+
+
+@pytest.mark.parametrize('size', [1, 5, 100000])
+def test_numbers_at_chunks_boundaries(size):
+    data = b'{"datasets":[12345,6.789e2],"nhits":1234567}'
+
+    members = list(JSONObjectStream(chunked(data, size), 'datasets'))
+
+    assert members == [('datasets', 12345), ('datasets', 678.9), ('nhits', 1234567)]
+
+
+@pytest.mark.parametrize('data', [b'{}', b' { "datasets" : [ ] } ', b'{"datasets":[]}'])
+def test_empty(data):
+    assert list(JSONObjectStream(chunked(data, 1), 'datasets')) == []
+
+
+def test_array_key_not_an_array():
+    data = b'{"datasets": null}'
+
+    assert list(JSONObjectStream([data], 'datasets')) == [('datasets', None)]
+
+
+@pytest.mark.parametrize('data', [b'[]', b'{"nhits": 1', b'{"datasets": [1 2]}', b'{"nhits" 1}'])
+def test_invalid(data):
+    with pytest.raises(ValueError):
+        list(JSONObjectStream(chunked(data, 2), 'datasets'))
+
+
+@pytest.mark.parametrize('size', [1, 4, 100000])
+def test_json_lines(size):
+    data = b'{"dataset_id": "a"}\n\n{"dataset_id": "\xc3\xa9t\xc3\xa9"}\n{"dataset_id": "c"}'
+
+    lines = list(iter_json_lines(chunked(data, size)))
+
+    assert lines == [{'dataset_id': 'a'}, {'dataset_id': 'été'}, {'dataset_id': 'c'}]
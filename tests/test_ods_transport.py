@@ -0,0 +1,114 @@
+import gzip
+
+import pytest
+import requests
+
+from udata_ods import transport
+from udata_ods.transport import Transport, get_transport
+
+URL = 'http://example.com/api/datasets/1.0/search/'
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    '''Record and skip retries delays'''
+    delays = []
+    monkeypatch.setattr(transport.time, 'sleep', delays.append)
+    return delays
+
+
+def test_no_retry_on_success(rmock, sleeps):
+    rmock.get(URL, json={'nhits': 0})
+    stats = {}
+
+    response = Transport().get(URL, stats=stats)
+
+    assert response.json() == {'nhits': 0}
+    assert stats == {'requests': 1, 'bytes': len(response.content)}
+    assert sleeps == []
+
+
+def test_retry_throttled_honoring_retry_after(rmock, sleeps):
+    rmock.get(URL, [
+        {'status_code': 429, 'headers': {'Retry-After': '7'}},
+        {'status_code': 503},
+        {'json': {'nhits': 0}},
+    ])
+    stats = {}
+
+    response = Transport(backoff=1).get(URL, stats=stats)
+
+    assert response.ok
+    assert stats['requests'] == 3
+    assert stats['retries'] == 2
+    assert sleeps[0] == 7
+    assert 0 <= sleeps[1] <= 2
+
+
+def test_retry_after_is_bounded(rmock, sleeps):
+    rmock.get(URL, [
+        {'status_code': 429, 'headers': {'Retry-After': '3600'}},
+        {'json': {}},
+    ])
+
+    Transport(max_backoff=10).get(URL)
+
+    assert sleeps == [10]
+
+
+def test_retry_connection_errors(rmock, sleeps):
+    rmock.get(URL, [
+        {'exc': requests.ConnectTimeout},
+        {'exc': requests.ConnectionError},
+        {'json': {}},
+    ])
+    stats = {}
+
+    assert Transport().get(URL, stats=stats).ok
+    assert stats['retries'] == 2
+
+
+def test_give_up_after_max_retries(rmock, sleeps):
+    rmock.get(URL, status_code=503)
+
+    response = Transport(max_retries=2).get(URL)
+
+    assert response.status_code == 503
+    assert len(sleeps) == 2
+    assert rmock.call_count == 3
+
+
+def test_raise_after_max_retries(rmock, sleeps):
+    rmock.get(URL, exc=requests.ConnectionError)
+
+    with pytest.raises(requests.ConnectionError):
+        Transport(max_retries=1).get(URL)
+    assert rmock.call_count == 2
+
+
+def test_bytes_transferred(rmock):
+    body = b'{"nhits": 0, "datasets": []}' * 100
+    compressed = gzip.compress(body)
+    rmock.get(URL, content=compressed, headers={'Content-Encoding': 'gzip'})
+    stats = {}
+
+    response = Transport().get(URL, stats=stats)
+
+    assert response.content == body
+    # Compressed bytes are counted
+    assert stats['bytes'] == len(compressed)
+
+
+def test_compression_accepted(rmock):
+    rmock.get(URL, json={})
+
+    Transport().get(URL)
+
+    assert 'gzip' in rmock.last_request.headers['Accept-Encoding']
+
+
+def test_transport_shared_by_host():
+    first = get_transport('http://shared.example.com/api/')
+    assert get_transport('http://shared.example.com/other/') is first
+    assert get_transport('http://other.example.com/api/') is not first
+    assert get_transport('http://shared.example.com/api/', timeout=1) is not first
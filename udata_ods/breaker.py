@@ -0,0 +1,87 @@
+'''
+Circuit breaker for unreachable ODS portals
+'''
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    '''Raised instead of requesting a domain considered unreachable'''
+    pass
+
+
+class CircuitBreaker(object):
+    '''
+    Stop requesting a domain after `threshold` consecutive connection errors or timeouts.
+
+    Once open, requests fail fast until `reset_timeout` seconds have passed.
+    Then a single probe request is allowed (half-open state):
+    its success closes the circuit, its failure opens it again.
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, domain, threshold=5, reset_timeout=60):
+        self.domain = domain
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        '''Check a request can be performed, raise `CircuitOpenError` otherwise'''
+        with self._lock:
+            if self.state == self.OPEN:
+                elapsed = time.time() - self.opened_at
+                if elapsed < self.reset_timeout:
+                    msg = ('{0} is unreachable ({1} consecutive connection errors), '
+                           'requests are suspended for {2:.0f}s')
+                    raise CircuitOpenError(msg.format(self.domain, self.failures,
+                                                      self.reset_timeout - elapsed))
+                self.state = self.HALF_OPEN
+            elif self.state == self.HALF_OPEN and self.probing:
+                msg = '{0} is unreachable, waiting for a probe request to succeed'
+                raise CircuitOpenError(msg.format(self.domain))
+            self.probing = self.state == self.HALF_OPEN
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def release(self):
+        '''Release the probe of a request which failed for another reason than a connection error'''
+        with self._lock:
+            self.probing = False
+
+    def failure(self):
+        '''Record a connection failure. Return whether it opened the circuit'''
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED
+                                                and self.failures >= self.threshold):
+                self.state = self.OPEN
+                self.opened_at = time.time()
+                self.trips += 1
+                return True
+            return False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(domain, threshold=5, reset_timeout=60):
+    '''Get the process-wide circuit breaker for a given domain'''
+    key = (domain, threshold, reset_timeout)
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(domain, threshold, reset_timeout)
+        return _breakers[key]
@@ -0,0 +1,102 @@
+'''
+Bulk writes of harvested documents
+'''
+from bson import ObjectId
+from mongoengine import signals
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+class BulkWriter(object):
+    '''
+    Buffer documents and save them with unordered bulk upserts of `size` documents.
+
+    Documents go through the same hooks as `Document.save`
+    (`pre_save` signal, validation, `pre_save_post_validation` and `post_save` signals).
+    Each document outcome is reported to its callback, with `None` or the raised error,
+    so a faulty document does not fail the others.
+    A document sharing a unique value (ie. a slug) with another one of the same batch
+    is saved on its own once the batch is written.
+    '''
+    def __init__(self, document_class, size):
+        self.document_class = document_class
+        self.size = size
+        self.pending = []
+
+    def add(self, document, callback):
+        self.pending.append((document, callback))
+        if len(self.pending) >= self.size:
+            self.flush()
+
+    @property
+    def unique_fields(self):
+        return [name for name, field in self.document_class._fields.items()
+                if getattr(field, 'unique', False) and name != 'id']
+
+    def prepare(self, document, created):
+        '''Run the pre-save hooks of a document and get its write operation'''
+        signals.pre_save.send(self.document_class, document=document)
+        document.validate()
+        signals.pre_save_post_validation.send(self.document_class, document=document,
+                                              created=created)
+        if created:
+            if document.pk is None:
+                document.pk = ObjectId()
+            return ReplaceOne({'_id': document.pk}, document.to_mongo(), upsert=True)
+        update = document._get_update_doc()
+        if update:
+            return UpdateOne({'_id': document.pk}, update, upsert=True)
+
+    def flush(self):
+        '''Write the buffered documents'''
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        operations, batch, deferred = [], [], []
+        seen = set()
+        for document, callback in pending:
+            created = document.pk is None or document._created
+            try:
+                operation = self.prepare(document, created)
+            except Exception as e:
+                callback(e)
+                continue
+            # Unique values (ie. slugs) are computed by the pre-save hooks
+            values = {(name, document[name]) for name in self.unique_fields
+                      if document[name] is not None}
+            if values & seen:
+                deferred.append((document, callback))
+                continue
+            seen.update(values)
+            if operation:
+                operations.append(operation)
+            batch.append((document, callback, created, operation))
+
+        errors = {}
+        if operations:
+            collection = self.document_class._get_collection()
+            try:
+                collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                errors = {error['index']: error for error in e.details['writeErrors']}
+
+        index = 0
+        for document, callback, created, operation in batch:
+            if operation:
+                error = errors.get(index)
+                index += 1
+                if error:
+                    callback(Exception('Bulk write error: {0}'.format(error['errmsg'])))
+                    continue
+            signals.post_save.send(self.document_class, document=document, created=created)
+            document._clear_changed_fields()
+            document._created = False
+            callback(None)
+
+        for document, callback in deferred:
+            try:
+                document.save()
+            except Exception as e:
+                callback(e)
+            else:
+                callback(None)
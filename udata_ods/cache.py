@@ -0,0 +1,183 @@
+'''
+Persistent HTTP responses cache for conditional requests
+'''
+import io
+import json
+import os
+import sqlite3
+import time
+
+from contextlib import closing
+from hashlib import sha1
+from urllib.parse import urlencode
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+SCHEMA = '''
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    source TEXT,
+    url TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    headers TEXT,
+    content BLOB,
+    size INTEGER,
+    accessed REAL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+CREATE INDEX IF NOT EXISTS responses_source ON responses (source);
+-- Running total of the cached content size, maintained by triggers
+CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER);
+INSERT OR IGNORE INTO totals SELECT 'size', COALESCE(SUM(size), 0) FROM responses;
+CREATE TRIGGER IF NOT EXISTS responses_inserted AFTER INSERT ON responses BEGIN
+    UPDATE totals SET value = value + NEW.size WHERE name = 'size';
+END;
+CREATE TRIGGER IF NOT EXISTS responses_deleted AFTER DELETE ON responses BEGIN
+    UPDATE totals SET value = value - OLD.size WHERE name = 'size';
+END;
+COMMIT;
+'''
+
+# Response headers kept along the cached content
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+class CacheEntry(object):
+    def __init__(self, url, etag, last_modified, headers, content):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.headers = json.loads(headers)
+        self.content = content
+
+    @property
+    def conditional_headers(self):
+        '''Headers validating this entry on the remote side'''
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def to_response(self):
+        '''Rebuild a `requests.Response` from this entry'''
+        response = Response()
+        response.status_code = 200
+        response.url = self.url
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.content
+        # Behave as a fully read response, even for callers streaming or closing it
+        response._content_consumed = True
+        response.raw = io.BytesIO(self.content)
+        response.encoding = 'utf-8'
+        return response
+
+
+class ResponseCache(object):
+    '''
+    A SQLite-backed HTTP responses cache, shared by all processes using the same `path`.
+
+    Only responses with an `ETag` or a `Last-Modified` header are stored.
+    Least recently used entries are evicted above `max_size` bytes of content.
+    '''
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    def connect(self):
+        # A connection per operation as the cache may be used from several threads
+        return closing(sqlite3.connect(self.path, timeout=30))
+
+    @staticmethod
+    def key(url, params=None, source=None):
+        '''
+        Compute the cache key of a given URL and its query parameters,
+        distinct for each source so sources sharing URLs are purged independently.
+        '''
+        if params:
+            params = sorted((k, sorted(v) if isinstance(v, (set, list, tuple)) else v)
+                            for k, v in params.items())
+            url = '{0}?{1}'.format(url, urlencode(params, doseq=True))
+        if source:
+            url = '{0} {1}'.format(source, url)
+        return sha1(url.encode('utf8')).hexdigest()
+
+    def get(self, key):
+        '''Get a cache entry, marking it as recently used'''
+        with self.connect() as db, db:
+            row = db.execute('SELECT url, etag, last_modified, headers, content '
+                             'FROM responses WHERE key = ?', (key,)).fetchone()
+            if row:
+                db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+        return CacheEntry(*row) if row else None
+
+    def set(self, key, source, response):
+        '''Store a response if it can be validated later. Return whether it has been stored'''
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not response.ok or not (etag or last_modified):
+            return False
+        headers = {h: response.headers[h] for h in KEPT_HEADERS if h in response.headers}
+        content = response.content
+        with self.connect() as db, db:
+            # Not replaced, as `REPLACE` does not fire the delete trigger
+            db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            db.execute('INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                key, source, response.url, etag, last_modified, json.dumps(headers), content,
+                len(content), time.time()
+            ))
+            self.evict(db)
+        return True
+
+    @staticmethod
+    def total_size(db):
+        return db.execute("SELECT value FROM totals WHERE name = 'size'").fetchone()[0]
+
+    def evict(self, db):
+        '''Remove least recently used entries until the cache fits into `max_size`'''
+        total = self.total_size(db)
+        if total <= self.max_size:
+            return
+        evicted = []
+        for key, size in db.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            evicted.append((key,))
+            total -= size
+            if total <= self.max_size:
+                break
+        db.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def purge(self, source=None):
+        '''Remove all entries (or only a given source ones). Return the removed entries count'''
+        with self.connect() as db, db:
+            if source:
+                cursor = db.execute('DELETE FROM responses WHERE source = ?', (source,))
+            else:
+                cursor = db.execute('DELETE FROM responses')
+            return cursor.rowcount
+
+    @property
+    def size(self):
+        with self.connect() as db:
+            return self.total_size(db)
+
+
+_caches = {}
+
+
+def get_cache(directory, max_size):
+    '''Get the process-wide responses cache stored into a given directory'''
+    path = os.path.join(directory, 'responses.sqlite')
+    if path not in _caches:
+        _caches[path] = ResponseCache(path, max_size)
+    cache = _caches[path]
+    cache.max_size = max_size
+    return cache
@@ -0,0 +1,36 @@
+import logging
+
+import click
+
+from flask import current_app
+
+from udata.commands import cli, exit_with_error, success
+from udata.harvest import actions
+
+from .cache import get_cache
+from .harvesters import OdsBackend
+
+log = logging.getLogger(__name__)
+
+
+@cli.group('ods')
+def grp():
+    '''OpenDataSoft integration operations'''
+    pass
+
+
+@grp.command('purge-cache')
+@click.argument('identifier', required=False)
+def purge_cache(identifier=None):
+    '''Purge the responses cache for a given harvest source (or all sources)'''
+    directory = current_app.config.get('ODS_CACHE_DIR')
+    if not directory:
+        exit_with_error('ODS responses cache is disabled (ODS_CACHE_DIR is not set)')
+    max_size = current_app.config.get('ODS_CACHE_MAX_SIZE', OdsBackend.CACHE_MAX_SIZE)
+    cache = get_cache(directory, max_size)
+    if identifier:
+        source = actions.get_source(identifier)
+        count = cache.purge(str(source.id))
+    else:
+        count = cache.purge()
+    success('Purged {0} cached responses'.format(count))
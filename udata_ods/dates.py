@@ -0,0 +1,47 @@
+'''
+Dates parsing with a fast path for ISO-8601 timestamps (as returned by ODS)
+'''
+import re
+
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+from dateutil.parser import parse as dateutil_parse
+
+ISO_8601 = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?(Z|[+-]\d{2}:?\d{2})?)?$'
+)
+
+
+def parse_iso_date(value):
+    '''Parse a strict ISO-8601 date or datetime, return `None` for any other format'''
+    match = ISO_8601.match(value)
+    if not match:
+        return
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    tzinfo = None
+    if offset == 'Z':
+        tzinfo = timezone.utc
+    elif offset:
+        sign = -1 if offset[0] == '-' else 1
+        delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[-2:]))
+        tzinfo = timezone.utc if not delta else timezone(sign * delta)
+    return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0),
+                    int(second or 0), int(fraction.ljust(6, '0')) if fraction else 0,
+                    tzinfo=tzinfo)
+
+
+@lru_cache(maxsize=1024)
+def parse_date(value):
+    '''
+    Parse a date string, ISO-8601 timestamps without `dateutil`.
+
+    Results are memoized as a same timestamp is parsed by each processing stage.
+    Raise `ValueError` on unparseable dates.
+    '''
+    try:
+        date = parse_iso_date(value)
+    except ValueError:  # Out of range values
+        date = None
+    return date or dateutil_parse(value)
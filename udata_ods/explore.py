@@ -0,0 +1,26 @@
+'''
+ODS Explore API (v2.1) helpers
+'''
+ODS_API_PATH = 'api/explore/v2.1'
+
+# Map filters key to ODS facets
+FILTERS = {
+    'tags': 'keyword',
+    'publisher': 'publisher',
+}
+
+
+def catalog_export_url(source_url, format):
+    return f'{source_url}/{ODS_API_PATH}/catalog/exports/{format}'
+
+
+def build_where_clause(filters):
+    if not filters:
+        return {}
+    params = []
+    for f in filters:
+        ods_key = FILTERS.get(f['key'], f['key'])
+        op = 'NOT ' if f.get('type') == 'exclude' else ''
+        params.append(op + ods_key + f'="{f["value"]}"')
+    where_clause = {"where": ' AND '.join(params)}
+    return where_clause
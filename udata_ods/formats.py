@@ -0,0 +1,62 @@
+'''
+MIME types and formats lookups, computed once at import
+'''
+import mimetypes
+import os
+
+from functools import lru_cache
+from types import MappingProxyType
+
+# Load the system MIME types (as any `mimetypes` lookup does) before freezing them
+if not mimetypes.inited:
+    mimetypes.init()
+
+# ODS specific MIME types (unknown from `mimetypes`) and their formats
+ODS_FORMATS = {
+    'application/vnd.geo+json': 'geojson',
+    'application/geo+json': 'geojson',
+    'application/x-zipped-shp': 'shp',
+    'application/x-shapefile': 'shp',
+}
+
+# MIME types considered as valid
+KNOWN_MIMETYPES = frozenset(mimetypes.types_map.values()) | frozenset(ODS_FORMATS)
+
+# Lowercased MIME types to their format (ie. their first known extension)
+MIME_FORMATS = {}
+for mimetype in mimetypes.types_map.values():
+    ext = mimetypes.guess_extension(mimetype)
+    if ext:
+        MIME_FORMATS[mimetype.lower()] = ext[1:]
+MIME_FORMATS.update(ODS_FORMATS)
+MIME_FORMATS = MappingProxyType(MIME_FORMATS)
+
+
+@lru_cache(maxsize=4096)
+def guess_url_mimetype(url):
+    mime, encoding = mimetypes.guess_type(url)
+    return mime
+
+
+def guess_format(mimetype, url=None):
+    '''
+    Guess a file format given a MIME type and/or an url
+    '''
+    # TODO: factorize in udata
+    format = MIME_FORMATS.get(mimetype.lower()) if mimetype else None
+    if not format and url:
+        ext = os.path.splitext(url)[1]
+        format = ext[1:] if ext else None
+    return format
+
+
+def guess_mimetype(mimetype, url=None):
+    '''
+    Guess a MIME type given a string or and URL
+    '''
+    # TODO: factorize in udata
+    mimetype = mimetype.lower() if mimetype else None
+    if mimetype in KNOWN_MIMETYPES:
+        return mimetype
+    elif url:
+        return guess_url_mimetype(url)
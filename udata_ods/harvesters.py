@@ -1,39 +1,64 @@
-import mimetypes
-import os
+import logging
+import time
+import traceback
 
-from dateutil.parser import parse as parse_date
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from hashlib import sha1
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+from flask import current_app
+from werkzeug.utils import import_string
 
 from udata.core.dataset.models import HarvestDatasetMetadata, HarvestResourceMetadata
 from udata.frontend.markdown import parse_html
 from udata.i18n import gettext as _
 from udata.harvest.backends.base import BaseBackend, HarvestFilter, HarvestFeature
-from udata.harvest.exceptions import HarvestSkipException
-from udata.models import License, Resource
-from udata.utils import get_by
-
-
-def guess_format(mimetype, url=None):
-    '''
-    Guess a file format given a MIME type and/or an url
-    '''
-    # TODO: factorize in udata
-    ext = mimetypes.guess_extension(mimetype)
-    if not ext and url:
-        parts = os.path.splitext(url)
-        ext = parts[1] if parts[1] else None
-    return ext[1:] if ext and ext.startswith('.') else ext
-
-
-def guess_mimetype(mimetype, url=None):
-    '''
-    Guess a MIME type given a string or and URL
-    '''
-    # TODO: factorize in udata
-    if mimetype in mimetypes.types_map.values():
-        return mimetype
-    elif url:
-        mime, encoding = mimetypes.guess_type(url)
-        return mime
+from udata.harvest.exceptions import HarvestSkipException, HarvestValidationError
+from udata.harvest.models import HarvestError, HarvestJob
+from udata.models import Dataset, License, Resource
+from udata.utils import get_by, safe_unicode
+
+from .breaker import get_breaker
+from .bulk import BulkWriter
+from .cache import get_cache
+from .dates import parse_date
+from .explore import FILTERS, build_where_clause, catalog_export_url
+from .formats import guess_format, guess_mimetype
+from .licenses import get_license_cache
+from .metrics import DISABLED, StageTimings, merge_timings
+from .pagination import AdaptivePageSize
+from .profiling import ItemProfiler, merge_profiles
+from .ratelimit import get_limiter
+from .store import PayloadStore
+from .stream import JSONObjectStream, iter_json_lines
+from .transport import get_transport, wire_size
+
+log = logging.getLogger(__name__)
+
+# Licenses cache key of the default license (ODS license strings are strings or `None`)
+DEFAULT_LICENSE_KEY = ('default',)
+
+
+@lru_cache(maxsize=1024)
+def fields_description(fields):
+    '''Build a markdown list from `(label, name, type, description)` fields'''
+    lines = []
+    for label, name, type, description in fields:
+        line = f'- *{label}*: {name}[{type}]'
+        if description:
+            line += f' {description}'
+        lines.append(line + '\n')
+    return ''.join(lines)
+
+
+@lru_cache(maxsize=256)
+def html_to_markdown(html):
+    '''`parse_html` shared by datasets with the same description (ie. publisher boilerplate)'''
+    return parse_html(html)
 
 
 class OdsBackend(BaseBackend):
@@ -46,18 +71,49 @@ class OdsBackend(BaseBackend):
     features = (
         HarvestFeature('inspire', _('Harvest Inspire datasets'),
                        _('Whether this harvester should import datasets coming from Inspire')),
+        HarvestFeature('search_payloads', _('Reuse search results'),
+                       _('Whether datasets metadata should be taken from search results '
+                         'instead of being fetched one by one')),
+        HarvestFeature('incremental', _('Incremental harvest'),
+                       _('Whether datasets not modified since the last harvest should be skipped')),
+        HarvestFeature('delta', _('Delta harvest'),
+                       _('Whether only datasets modified since the last successful harvest '
+                         'should be listed, a full harvest being performed periodically')),
+        HarvestFeature('adaptive_rows', _('Adaptive search pages'),
+                       _('Whether the search pages size should be adapted '
+                         'to the portal response times and payloads sizes')),
+        HarvestFeature('catalog_export', _('Catalog export'),
+                       _('Whether datasets should be listed in one pass from the catalog export '
+                         'instead of paginated searches (recommended for large portals)')),
+        HarvestFeature('batch_details', _('Batched datasets retrieval'),
+                       _('Whether datasets details should be fetched by batches '
+                         'with search requests instead of one by one. '
+                         'Only applies to harvests processed in a single process '
+                         '(ie. `udata harvest run`), not to scheduled ones')),
     )
 
     # Map filters key to ODS facets
-    FILTERS = {
-        'tags': 'keyword',
-        'publisher': 'publisher',
-    }
+    FILTERS = FILTERS
 
     # above this records count limit, shapefile export will be disabled
     # since it would be a partial export
     SHAPEFILE_RECORDS_LIMIT = 50000
 
+    # Datasets count per search page (can be overridden per source with the `rows` config key)
+    SEARCH_ROWS = 50
+
+    # Adaptive search pages bounds and targets
+    SEARCH_MIN_ROWS = 10
+    SEARCH_MAX_ROWS = 1000
+    SEARCH_TARGET_LATENCY = 2
+    SEARCH_TARGET_SIZE = 4 * 1024 ** 2
+
+    # Concurrent search pages requests once the datasets count is known
+    SEARCH_WORKERS = 4
+
+    # Size of the chunks read from streamed responses
+    STREAM_CHUNK_SIZE = 64 * 1024
+
     LICENSES = {
         'Open Database License (ODbL)': 'odc-odbl',
         'Licence Ouverte (Etalab)': 'fr-lo',
@@ -73,6 +129,214 @@ class OdsBackend(BaseBackend):
         'shp': ('Shapefile', 'shp', None),
     }
 
+    # Days between full harvests when the delta feature is enabled
+    FULL_HARVEST_DAYS = 7
+
+    # Wall-clock seconds a job may run (can be overridden per source with the `time_budget`
+    # config key). Items are then processed most outdated first and those left when the budget
+    # runs out are postponed to the next job (disabled unless given)
+    TIME_BUDGET = None
+
+    # Keys a search result must have to be processed without being fetched again
+    PAYLOAD_KEYS = ('datasetid', 'metas', 'features', 'fields', 'has_records')
+
+    # Datasets fetched per search request when the `batch_details` feature is enabled
+    BATCH_SIZE = 50
+
+    # Datasets saved per bulk write when processing items in the same process (0 disables)
+    BULK_SIZE = 0
+
+    # Concurrent dataset fetches running ahead of the processed item
+    # when processing items in the same process (0 disables prefetching)
+    PREFETCH_WORKERS = 0
+
+    # HTTP transport tuning (see `udata_ods.transport.Transport`)
+    POOL_SIZE = 10
+    MAX_RETRIES = 5
+    BACKOFF = 0.5
+    TIMEOUT = 60
+
+    # Requests per second per ODS domain (disabled unless given),
+    # either limited in-process or shared by all workers through MongoDB
+    RATE_LIMIT = None
+    RATE_LIMIT_BURST = 5
+    RATE_LIMIT_SHARED = False
+
+    # Consecutive connection errors before suspending requests to an ODS domain,
+    # and seconds before probing it again
+    CIRCUIT_THRESHOLD = 5
+    CIRCUIT_RESET_TIMEOUT = 60
+
+    # Conditional requests responses cache (disabled unless a directory is given)
+    CACHE_DIR = None
+    CACHE_MAX_SIZE = 512 * 1024 * 1024
+
+    # Seconds resolved licenses are kept by ODS license string (0 disables caching)
+    LICENSE_CACHE_TTL = 300
+
+    # Record the wall time of the harvest stages on the job,
+    # and give each measure to an optional `hook(stage, seconds, tags)` (or its import path)
+    TIMINGS = False
+    METRICS_HOOK = None
+
+    # Profile a fraction of the items, or all items keeping those slower than a threshold
+    # (in seconds), reporting their hotspots (and allocations) on the job
+    PROFILE_RATE = 0
+    PROFILE_THRESHOLD = None
+    PROFILE_MEMORY = False
+    PROFILE_TOP = 10
+    PROFILE_MAX_REPORTS = 20
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Pending dataset API responses by dataset ID
+        self.prefetched = {}
+        # Datasets bulk writer while processing items in bulk mode
+        self.writer = None
+        # Counters not yet reported on the job
+        self.stats = {}
+        # Resolved here as requests may be performed outside of the application context
+        self.transport = get_transport(self.source_url,
+                                       pool_size=self.get_setting('POOL_SIZE'),
+                                       max_retries=self.get_setting('MAX_RETRIES'),
+                                       backoff=self.get_setting('BACKOFF'),
+                                       timeout=self.get_setting('TIMEOUT'))
+        domain = urlparse(self.source_url).netloc
+        self.breaker = get_breaker(domain,
+                                   threshold=self.get_setting('CIRCUIT_THRESHOLD'),
+                                   reset_timeout=self.get_setting('CIRCUIT_RESET_TIMEOUT'))
+        rate = self.get_setting('RATE_LIMIT')
+        self.limiter = get_limiter(domain, rate,
+                                   burst=self.get_setting('RATE_LIMIT_BURST'),
+                                   shared=self.get_setting('RATE_LIMIT_SHARED')) if rate else None
+        cache_dir = self.get_setting('CACHE_DIR')
+        self.cache = get_cache(cache_dir, self.get_setting('CACHE_MAX_SIZE')) if cache_dir else None
+        self.search_rows = int(self.source_setting('rows', 'SEARCH_ROWS', int))
+        time_budget = self.source_setting('time_budget', 'TIME_BUDGET', float)
+        self.time_budget = float(time_budget) if time_budget else None
+        # Items postponed by the time budget not yet reported on the job
+        self.postponed = []
+        self.licenses = get_license_cache(self.get_setting('LICENSE_CACHE_TTL'))
+        hook = self.get_setting('METRICS_HOOK')
+        if isinstance(hook, str):
+            hook = import_string(hook)
+        if self.get_setting('TIMINGS') or hook:
+            self.timings = StageTimings(hook, {'domain': domain, 'source': self.source.slug})
+        else:
+            self.timings = None
+        # When the last item processing ended, the remaining being its save
+        self.processed_at = None
+        rate = self.get_setting('PROFILE_RATE')
+        threshold = self.get_setting('PROFILE_THRESHOLD')
+        if rate or threshold is not None:
+            self.profiler = ItemProfiler(rate, threshold,
+                                         memory=self.get_setting('PROFILE_MEMORY'),
+                                         top=self.get_setting('PROFILE_TOP'))
+        else:
+            self.profiler = None
+        self.profile_reports_limit = self.get_setting('PROFILE_MAX_REPORTS')
+        # Items profiles not yet reported on the job
+        self.profiles = []
+
+    def get(self, url, headers=None, **kwargs):
+        '''
+        Perform a GET request through the transport,
+        using conditional requests if the responses cache is enabled.
+
+        Streamed responses are not cached, as caching them would read them whole in memory.
+        '''
+        headers = dict(headers or {}, **self.get_headers())
+        kwargs['verify'] = kwargs.get('verify', self.verify_ssl)
+        if not self.cache or kwargs.get('stream'):
+            return self.transport.get(url, headers=headers, stats=self.stats,
+                                      limiter=self.limiter, breaker=self.breaker, **kwargs)
+        key = self.cache.key(url, kwargs.get('params'), str(self.source.id))
+        entry = self.cache.get(key)
+        if entry:
+            headers.update(entry.conditional_headers)
+        response = self.transport.get(url, headers=headers, stats=self.stats,
+                                      limiter=self.limiter, breaker=self.breaker, **kwargs)
+        if entry and response.status_code == 304:
+            self.transport.count(self.stats, 'cache_hits')
+            # Give its connection back to the pool
+            response.close()
+            return entry.to_response()
+        self.cache.set(key, str(self.source.id), response)
+        return response
+
+    def raise_for_status(self, response):
+        '''Raise on an HTTP error status, releasing the (streamed) response connection first'''
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+
+    def stage(self, name):
+        '''Measure a harvest stage if timings are enabled'''
+        return self.timings.stage(name) if self.timings else DISABLED
+
+    def profile(self, item):
+        '''Profile an item processing if profiling is enabled and the item sampled'''
+        if not self.profiler or not self.profiler.sampled():
+            return DISABLED
+        return self.profiler.profile(self.profiles, remote_id=item.remote_id)
+
+    def flush_stats(self):
+        '''Report the counters and timings gathered since the last flush on the job'''
+        # Reset in place as in-flight requests (ie. prefetches) may still count into it
+        stats = self.transport.drain(self.stats)
+        timings = self.timings.drain() if self.timings else {}
+        profiles, self.profiles = self.profiles, []
+        postponed, self.postponed = self.postponed, []
+        if not (stats or timings or profiles or postponed) or not self.job:
+            return
+        if self.job.id and not self.dryrun:
+            # Atomic increments as items may be processed concurrently by several workers
+            inc = {'data.ods_stats.{0}'.format(key): value for key, value in stats.items()}
+            maximums = {}
+            for name, stage in timings.items():
+                for key, value in stage.items():
+                    path = 'data.ods_timings.{0}.{1}'.format(name, key)
+                    if key == 'max':
+                        maximums[path] = value
+                    else:
+                        inc[path] = value
+            update = {'$inc': inc, '$set': {'data.ods_circuit': self.breaker.state}}
+            if maximums:
+                update['$max'] = maximums
+            push = {}
+            if profiles:
+                # Only keep the slowest items
+                push['data.ods_profiles'] = {
+                    '$each': profiles,
+                    '$sort': {'seconds': -1},
+                    '$slice': self.profile_reports_limit,
+                }
+            if postponed:
+                push['data.ods_postponed'] = {'$each': postponed}
+            if push:
+                update['$push'] = push
+            HarvestJob.objects(id=self.job.id).update_one(__raw__=update)
+        else:
+            job_stats = self.job.data.setdefault('ods_stats', {})
+            for key, value in stats.items():
+                job_stats[key] = job_stats.get(key, 0) + value
+            if timings:
+                merge_timings(self.job.data.setdefault('ods_timings', {}), timings)
+            if profiles:
+                merge_profiles(self.job.data.setdefault('ods_profiles', []), profiles,
+                               self.profile_reports_limit)
+            if postponed:
+                self.job.data.setdefault('ods_postponed', []).extend(postponed)
+            self.job.data['ods_circuit'] = self.breaker.state
+
+    @property
+    def payloads(self):
+        if getattr(self, '_payloads', None) is None or self._payloads.job is not self.job:
+            self._payloads = PayloadStore(self.job)
+        return self._payloads
+
     @property
     def source_url(self):
         return self.source.url.rstrip('/')
@@ -81,6 +345,10 @@ class OdsBackend(BaseBackend):
     def api_search_url(self):
         return '{0}/api/datasets/1.0/search/'.format(self.source_url)
 
+    @property
+    def api_catalog_export_url(self):
+        return catalog_export_url(self.source_url, 'jsonl')
+
     def api_dataset_url(self, dataset_id):
         return '{0}/api/datasets/1.0/{1}/'.format(self.source_url, dataset_id)
 
@@ -100,43 +368,569 @@ class OdsBackend(BaseBackend):
     def export_url(self, dataset_id):
         return '{0}?tab=export'.format(self.explore_url(dataset_id))
 
+    def get_setting(self, key):
+        '''Get an `ODS_`-prefixed setting, defaulting to the matching class attribute'''
+        return current_app.config.get('ODS_{0}'.format(key), getattr(self, key))
+
+    def source_setting(self, key, setting, cast):
+        '''
+        Get a positive number from the source `key` config, defaulting to a setting.
+
+        An invalid value is ignored with a warning rather than failing every harvest task.
+        '''
+        value = self.config.get(key)
+        if value is None or value == '':
+            return self.get_setting(setting)
+        try:
+            number = cast(value)
+        except (TypeError, ValueError):
+            number = None
+        if number is None or number <= 0:
+            log.warning('Invalid %s config for source %s: %r, using ODS_%s instead',
+                        key, self.source.slug, value, setting)
+            return self.get_setting(setting)
+        return number
+
+    def search_params(self, start, rows=None):
+        params = {
+            'start': start,
+            'rows': rows or self.search_rows,
+            'interopmetas': 'true',
+        }
+        for f in self.get_filters():
+            ods_key = self.FILTERS.get(f['key'], f['key'])
+            op = 'exclude' if f.get('type') == 'exclude' else 'refine'
+            key = '.'.join((op, ods_key))
+            param = params.get(key, set())
+            param.add(f['value'])
+            params[key] = param
+        if self.job and self.job.data.get('ods_delta'):
+            params['q'] = 'modified>={0}'.format(self.job.data['ods_delta'])
+        return params
+
+    def export_params(self):
+        params = build_where_clause(self.get_filters())
+        if self.job and self.job.data.get('ods_delta'):
+            delta = "modified>=date'{0}'".format(self.job.data['ods_delta'])
+            params['where'] = ' AND '.join(filter(None, (params.get('where'), delta)))
+        return params
+
+    def search(self, start, rows=None):
+        '''
+        Fetch a search page of `rows` datasets (defaults to the source page size)
+        starting at a given offset.
+
+        The response is decoded as a stream and only the datasets IDs, modification dates
+        and (if reused) serialized payloads are kept, whatever the page size.
+        '''
+        started = time.monotonic()
+        with self.stage('search'):
+            response = self.get(self.api_search_url, params=self.search_params(start, rows),
+                                stream=True)
+            self.raise_for_status(response)
+        reuse_payloads = self.has_feature('search_payloads')
+        page = {'nhits': None, 'datasets': []}
+        # Decoded payload size, as targeted by adaptive pages
+        size = 0
+
+        def chunks():
+            nonlocal size
+            for chunk in response.iter_content(self.STREAM_CHUNK_SIZE):
+                size += len(chunk)
+                yield chunk
+
+        # Decoding a stream includes downloading its body
+        with response, self.stage('search_decode'):
+            for key, value in JSONObjectStream(chunks(), 'datasets'):
+                if key == 'nhits':
+                    page['nhits'] = value
+                elif key == 'datasets':
+                    page['datasets'].append({
+                        'datasetid': value['datasetid'],
+                        'modified': value.get('metas', {}).get('modified'),
+                        'payload': PayloadStore.serialize(value) if reuse_payloads else None,
+                    })
+        self.transport.count(self.stats, 'bytes', wire_size(response))
+        page['size'] = size
+        page['elapsed'] = time.monotonic() - started
+        return page
+
+    def search_pages(self, executor, first_page, max_value):
+        '''
+        Yield the search pages in order up to `max_value` datasets,
+        the remaining pages being fetched concurrently by `executor`.
+        '''
+        yield first_page
+        # The first page gives the effective page size as the portal may cap it
+        rows = len(first_page['datasets']) or self.search_rows
+        if not self.has_feature('adaptive_rows'):
+            # `map` yields pages in offsets order whatever the completion order
+            yield from executor.map(self.search, range(rows, max_value, rows))
+            return
+
+        sizer = AdaptivePageSize(self.search_rows,
+                                 min_rows=self.get_setting('SEARCH_MIN_ROWS'),
+                                 max_rows=self.get_setting('SEARCH_MAX_ROWS'),
+                                 target_latency=self.get_setting('SEARCH_TARGET_LATENCY'),
+                                 target_size=self.get_setting('SEARCH_TARGET_SIZE'))
+        if rows < self.search_rows:
+            sizer.limit(rows)
+        sizer.observe(rows, first_page['elapsed'], first_page['size'])
+        workers = self.get_setting('SEARCH_WORKERS')
+        pending = deque()
+        start = rows
+        while pending or start < max_value:
+            # Keep `workers` pages requests running, sized from the last fetched pages
+            while start < max_value and len(pending) < workers:
+                rows = min(sizer.rows, max_value - start)
+                pending.append((start, rows, executor.submit(self.search, start, rows)))
+                start += rows
+            page_start, rows, future = pending.popleft()
+            page = future.result()
+            sizer.observe(len(page['datasets']), page['elapsed'], page['size'])
+            # Complete pages capped by the portal to avoid missing datasets
+            while 0 < len(page['datasets']) < rows:
+                fetched = len(page['datasets'])
+                rest = self.search(page_start + fetched, rows - fetched)
+                if not rest['datasets']:
+                    break
+                sizer.limit(fetched)
+                page['datasets'].extend(rest['datasets'])
+            yield page
+
+    def get_delta_since(self):
+        '''
+        Get the date from which modified datasets should be listed in delta mode,
+        or `None` if a full harvest is required.
+        '''
+        jobs = HarvestJob.objects(source=self.source, status='done',
+                                  id__ne=self.job.id).order_by('-started')
+        last_full_job = jobs.filter(__raw__={'data.ods_delta': {'$exists': False}}).first()
+        full_harvest_days = timedelta(days=self.get_setting('FULL_HARVEST_DAYS'))
+        if not last_full_job or last_full_job.started < datetime.utcnow() - full_harvest_days:
+            return
+        # Keep a one day margin for timezones and clocks offsets
+        return (jobs.first().started - timedelta(days=1)).date()
+
+    def search_datasets(self, executor):
+        '''List the datasets with paginated searches, pages being fetched by `executor`'''
+        # The first page gives the total count of datasets
+        first_page = self.search(0)
+        nhits = first_page['nhits']
+        max_value = min(nhits, self.max_items) if self.max_items else nhits
+        count = 0
+        for data in self.search_pages(executor, first_page, max_value):
+            for dataset in data['datasets']:
+                count += 1
+                yield dataset
+            if count >= max_value:
+                return
+
+    def export_datasets(self):
+        '''
+        List the datasets in one pass from the catalog JSON lines export,
+        yielding them as they are downloaded.
+        '''
+        with self.stage('search'):
+            response = self.get(self.api_catalog_export_url, params=self.export_params(),
+                                stream=True)
+            self.raise_for_status(response)
+        try:
+            with response:
+                for dataset in iter_json_lines(response.iter_content(self.STREAM_CHUNK_SIZE)):
+                    yield {
+                        'datasetid': dataset['dataset_id'],
+                        'modified': dataset.get('metas', {}).get('default', {}).get('modified'),
+                        # Explore API payloads differ from the search API ones
+                        'payload': None,
+                    }
+        finally:
+            self.transport.count(self.stats, 'bytes', wire_size(response))
+
     def initialize(self):
+        if self.has_feature('delta'):
+            since = self.get_delta_since()
+            if since:
+                self.job.data['ods_delta'] = since.isoformat()
+
+        reuse_payloads = self.has_feature('search_payloads')
+        incremental = self.has_feature('incremental')
+        # Local datasets are looked up once for all items
+        with self.stage('local_index'):
+            index = self.local_datasets()
+        self.job.data['ods_index'] = True
+
         count = 0
-        nhits = None
-
-        def should_fetch():
-            if nhits is None:
-                return True
-            max_value = min(nhits, self.max_items) if self.max_items else nhits
-            return count < max_value
-
-        while should_fetch():
-            params = {
-                'start': count,
-                'rows': 50,
+        modified = {}
+        # Concurrent search pages may list a dataset twice if the listing shifts meanwhile,
+        # which would create it twice as new items are not looked up
+        listed = set()
+        with ThreadPoolExecutor(max_workers=self.get_setting('SEARCH_WORKERS')) as executor:
+            if self.has_feature('catalog_export'):
+                datasets = self.export_datasets()
+            else:
+                datasets = self.search_datasets(executor)
+            for dataset in datasets:
+                if dataset['datasetid'] in listed:
+                    continue
+                listed.add(dataset['datasetid'])
+                count += 1
+                kwargs = dict(index.get(dataset['datasetid'], {}))
+                if incremental:
+                    kwargs['modified'] = dataset['modified']
+                item = self.add_item(dataset['datasetid'], **kwargs)
+                if reuse_payloads and dataset['payload']:
+                    self.payloads.put(item, dataset['payload'])
+                if self.time_budget:
+                    modified[item.remote_id] = dataset['modified']
+                if self.max_items and count >= self.max_items:
+                    break
+            # Stop the listing (and close its response) if interrupted
+            datasets.close()
+        if self.time_budget:
+            self.prioritize(index, modified)
+        self.flush_stats()
+
+    def carried_over(self):
+        '''
+        Remote IDs postponed by the previous job of the source,
+        ignoring jobs which failed before processing any item.
+        '''
+        jobs = HarvestJob.objects(source=self.source, id__ne=self.job.id, __raw__={'$or': [
+            {'data.ods_postponed': {'$exists': True}},
+            {'items.0': {'$exists': True}},
+        ]})
+        job = jobs.order_by('-started').first()
+        return job.data.get('ods_postponed', []) if job and job.data else []
+
+    def prioritize(self, index, modified):
+        '''
+        Order the items of a time-budgeted job: those postponed by the previous job first,
+        then outdated ones and up to date ones last, most recently modified first.
+        '''
+        carried = self.carried_over()
+        # Delta harvests only list recently modified datasets, whereas a dataset missing
+        # from a full listing has been removed (or filtered out) and should not be processed
+        if self.job.data.get('ods_delta'):
+            listed = {item.remote_id for item in self.job.items}
+            for remote_id in carried:
+                if remote_id not in listed:
+                    listed.add(remote_id)
+                    self.add_item(remote_id, **index.get(remote_id, {}))
+        ranks = {remote_id: rank for rank, remote_id in enumerate(carried)}
+
+        def priority(item):
+            if item.remote_id in ranks:
+                return (0, ranks[item.remote_id])
+            remote = modified.get(item.remote_id)
+            group = 2 if self.is_unchanged(item.kwargs.get('modified_at'), remote) else 1
+            date = self.parse_date(remote) if remote else None
+            if date is None:
+                return (group, float('inf'))
+            if not date.tzinfo:
+                date = date.replace(tzinfo=timezone.utc)
+            return (group, -date.timestamp())
+
+        self.job.items = sorted(self.job.items, key=priority)
+
+    def process_items(self):
+        with self.bulk_writes():
+            self.process_items_ahead()
+
+    def process_items_ahead(self):
+        '''Process the job items, prefetching their datasets if enabled'''
+        workers = self.get_setting('PREFETCH_WORKERS')
+        batch_size = self.get_setting('BATCH_SIZE') if self.has_feature('batch_details') else 1
+        prefetch = workers or batch_size > 1
+        items = self.job.items
+        reuse_payloads = self.has_feature('search_payloads')
+        incremental = self.has_feature('incremental')
+
+        def needs_fetch(item):
+            if reuse_payloads and self.payloads.has(item):
+                return False
+            # Unchanged datasets are skipped without being fetched
+            return not (incremental and self.is_unchanged(item.kwargs.get('modified_at'),
+                                                          item.kwargs.get('modified')))
+
+        with ThreadPoolExecutor(max_workers=workers or 1) as executor:
+            scheduled = 0
+            for index, item in enumerate(items):
+                if self.out_of_time():
+                    self.postpone(items[index:])
+                    break
+                # Keep `workers` dataset fetches (or batches) running ahead of the processed item
+                while prefetch and scheduled < min(index + max(workers, 1) * batch_size + 1,
+                                                   len(items)):
+                    ahead = [i for i in items[scheduled:scheduled + batch_size] if needs_fetch(i)]
+                    if ahead:
+                        self.prefetch(executor, ahead, batch=batch_size > 1)
+                    scheduled += batch_size
+                self.process_item(item)
+
+    @contextmanager
+    def bulk_writes(self):
+        '''Buffer processed datasets to save them with bulk writes if enabled'''
+        size = 0 if self.dryrun else int(self.get_setting('BULK_SIZE') or 0)
+        if size <= 1:
+            yield
+            return
+        self.writer = BulkWriter(Dataset, size)
+        try:
+            yield
+        finally:
+            with self.stage('save'):
+                self.writer.flush()
+            self.writer = None
+            self.job.save()
+            self.flush_stats()
+
+    def out_of_time(self):
+        '''Whether the job time budget has run out'''
+        if not self.time_budget or not self.job.started:
+            return False
+        return datetime.utcnow() >= self.job.started + timedelta(seconds=self.time_budget)
+
+    def postpone(self, items):
+        '''Skip the items left when the time budget ran out, for the next job to process first'''
+        ended = datetime.utcnow()
+        for item in items:
+            item.status = 'skipped'
+            item.ended = ended
+            item.errors.append(HarvestError(message='Time budget exhausted, postponed'))
+            self.postponed.append(item.remote_id)
+            self.discard_prefetched(item)
+        if not self.dryrun:
+            self.job.save()
+        self.flush_stats()
+
+    def process_item(self, item):
+        if self.out_of_time():
+            return self.postpone([item])
+        with self.stage('item'), self.profile(item) as profile:
+            if self.writer:
+                self.buffer_item(item)
+            else:
+                self.processed_at = None
+                super().process_item(item)
+                if self.processed_at:
+                    # `BaseBackend.process_item` saves the processed dataset
+                    self.timings.observe('save', time.perf_counter() - self.processed_at)
+            if profile is not None:
+                profile['status'] = item.status
+        self.discard_prefetched(item)
+        self.flush_stats()
+
+    def buffer_item(self, item):
+        '''
+        Process an item like `BaseBackend.process_item` does,
+        but buffer its dataset for a bulk write instead of saving it.
+        '''
+        log.debug('Processing: %s', item.remote_id)
+        item.status = 'started'
+        item.started = datetime.utcnow()
+        try:
+            dataset = self.process(item)
+            if not dataset.harvest:
+                dataset.harvest = HarvestDatasetMetadata()
+            dataset.harvest.domain = self.source.domain
+            dataset.harvest.remote_id = item.remote_id
+            dataset.harvest.source_id = str(self.source.id)
+            dataset.harvest.last_update = datetime.utcnow()
+            dataset.harvest.backend = self.display_name
+            dataset.harvest.archived_at = None
+            dataset.harvest.archived = None
+            dataset.archived = None
+            if not dataset.organization and not dataset.owner:
+                if self.source.organization:
+                    dataset.organization = self.source.organization
+                elif self.source.owner:
+                    dataset.owner = self.source.owner
+        except HarvestSkipException as e:
+            log.info('Skipped item %s : %s', item.remote_id, safe_unicode(e))
+            item.status = 'skipped'
+            item.errors.append(HarvestError(message=safe_unicode(e)))
+        except HarvestValidationError as e:
+            log.info('Error validating item %s : %s', item.remote_id, safe_unicode(e))
+            item.status = 'failed'
+            item.errors.append(HarvestError(message=safe_unicode(e)))
+        except Exception as e:
+            log.exception('Error while processing %s : %s', item.remote_id, safe_unicode(e))
+            item.status = 'failed'
+            item.errors.append(HarvestError(message=safe_unicode(e),
+                                            details=traceback.format_exc()))
+        else:
+            with self.stage('save'):
+                self.writer.add(dataset, lambda error: self.item_written(item, dataset, error))
+                if not self.writer.pending:
+                    # A batch has just been written
+                    self.job.save()
+            return
+        item.ended = datetime.utcnow()
+
+    def item_written(self, item, dataset, error):
+        '''Report the bulk write outcome of an item dataset'''
+        if error:
+            log.error('Error while saving %s : %s', item.remote_id, safe_unicode(error))
+            item.status = 'failed'
+            item.errors.append(HarvestError(message=safe_unicode(error)))
+        else:
+            item.dataset = dataset
+            item.status = 'done'
+        item.ended = datetime.utcnow()
+
+    def prefetch(self, executor, items, batch=False):
+        '''Schedule the given items datasets fetches, one by one or as a single batch'''
+        if not batch:
+            for item in items:
+                self.prefetched[item.remote_id] = executor.submit(self.fetch_ods_dataset,
+                                                                  item.remote_id)
+            return
+        futures = {item.remote_id: Future() for item in items}
+
+        def dispatch(batch):
+            try:
+                datasets = batch.result()
+            except Exception as e:
+                # Items will fall back on single fetches
+                log.warning('Unable to fetch datasets batch: %s', e)
+                datasets = {}
+            for dataset_id, future in futures.items():
+                # Unless discarded meanwhile
+                if future.set_running_or_notify_cancel():
+                    future.set_result(datasets.get(dataset_id))
+
+        executor.submit(self.fetch_ods_datasets, list(futures)).add_done_callback(dispatch)
+        self.prefetched.update(futures)
+
+    def discard_prefetched(self, item):
+        '''
+        Release the prefetched dataset of an item ended without using it
+        (ie. skipped or postponed), cancelling its fetch if not started yet.
+        '''
+        future = self.prefetched.pop(item.remote_id, None)
+        if future:
+            future.cancel()
+
+    def fetch_ods_datasets(self, dataset_ids):
+        '''Fetch a batch of datasets with a single search request, indexed by ID'''
+        query = ' OR '.join('datasetid:"{0}"'.format(dataset_id) for dataset_id in dataset_ids)
+        with self.stage('fetch'):
+            response = self.get(self.api_search_url, params={
+                'q': query,
+                'rows': len(dataset_ids),
                 'interopmetas': 'true',
-            }
-            for f in self.get_filters():
-                ods_key = self.FILTERS.get(f['key'], f['key'])
-                op = 'exclude' if f.get('type') == 'exclude' else 'refine'
-                key = '.'.join((op, ods_key))
-                param = params.get(key, set())
-                param.add(f['value'])
-                params[key] = param
-            response = self.get(self.api_search_url, params=params)
+            })
             response.raise_for_status()
-            data = response.json()
-            nhits = data['nhits']
-            for dataset in data['datasets']:
-                count += 1
-                self.add_item(dataset['datasetid'])
+        with self.stage('decode'):
+            datasets = response.json()['datasets']
+        return {
+            dataset['datasetid']: dataset for dataset in datasets
+            if dataset['datasetid'] in dataset_ids and self.is_complete(dataset)
+        }
+
+    def fetch_ods_dataset(self, dataset_id):
+        '''Fetch a dataset from the ODS dataset API'''
+        with self.stage('fetch'):
+            response = self.get(self.api_dataset_url(dataset_id),
+                                params={'interopmetas': 'true'})
+            response.raise_for_status()
+        with self.stage('decode'):
+            return response.json()
+
+    def get_ods_dataset(self, item):
+        '''
+        Get the ODS dataset payload for a given item,
+        either from the stored search results, a prefetched response or the dataset API.
+        '''
+        ods_dataset = self.payloads.pop(item) if self.has_feature('search_payloads') else None
+        if ods_dataset and self.is_complete(ods_dataset):
+            return ods_dataset
+        future = self.prefetched.pop(item.remote_id, None)
+        ods_dataset = future.result() if future else None
+        if ods_dataset:
+            return ods_dataset
+        if future:
+            # Missing from its batch
+            self.transport.count(self.stats, 'batch_misses')
+        return self.fetch_ods_dataset(item.remote_id)
+
+    def is_complete(self, ods_dataset):
+        '''Whether a search result holds everything needed to process a dataset'''
+        return (all(key in ods_dataset for key in self.PAYLOAD_KEYS)
+                and 'modified' in ods_dataset['metas'])
+
+    def local_datasets(self):
+        '''
+        Index this source local datasets by remote ID with a single projected query.
+
+        Each entry gives the dataset ID and, unless archived,
+        its harvested modification date (as `dataset_id` and `modified_at` items kwargs).
+        '''
+        datasets = Dataset.objects(__raw__={
+            '$or': [
+                {'harvest.domain': self.source.domain},
+                {'harvest.source_id': str(self.source.id)},
+            ],
+        }).only('id', 'harvest.remote_id', 'harvest.modified_at', 'harvest.archived_at')
+        index = {}
+        for dataset in datasets.as_pymongo():
+            harvest = dataset.get('harvest') or {}
+            if not harvest.get('remote_id') or harvest['remote_id'] in index:
+                continue
+            entry = {'dataset_id': str(dataset['_id'])}
+            if harvest.get('modified_at') and not harvest.get('archived_at'):
+                entry['modified_at'] = harvest['modified_at']
+            index[harvest['remote_id']] = entry
+        return index
+
+    def get_local_dataset(self, item):
+        '''Get or create an item dataset, looked up from the index built at initialization'''
+        if not self.job.data.get('ods_index'):
+            return self.get_dataset(item.remote_id)
+        dataset_id = item.kwargs.get('dataset_id')
+        dataset = Dataset.objects(id=dataset_id).first() if dataset_id else None
+        if dataset is not None:
+            return dataset
+        elif dataset_id:
+            # Removed since the initialization
+            return self.get_dataset(item.remote_id)
+        elif self.source.organization:
+            return Dataset(organization=self.source.organization)
+        elif self.source.owner:
+            return Dataset(owner=self.source.owner)
+        return Dataset()
+
+    def local_modified_at(self, item):
+        '''Get the harvested modification date of an item dataset (if not archived)'''
+        if self.job.data.get('ods_index'):
+            return item.kwargs.get('modified_at')
+        dataset = self.get_dataset(item.remote_id)
+        if not dataset.id or not dataset.harvest or dataset.harvest.archived_at:
+            return
+        return dataset.harvest.modified_at
+
+    def is_unchanged(self, modified_at, modified):
+        '''Whether a local dataset is up to date given its and the remote modification dates'''
+        if not modified_at or not modified:
+            return False
+        remote = self.parse_date(modified)
+        if remote is None:
+            return False
+        if remote.tzinfo:
+            remote = remote.astimezone(timezone.utc).replace(tzinfo=None)
+        # MongoDB stores dates with a millisecond precision
+        remote = remote.replace(microsecond=remote.microsecond // 1000 * 1000)
+        return modified_at == remote
 
     def process(self, item):
         dataset_id = item.remote_id
-        response = self.get(self.api_dataset_url(dataset_id),
-                            params={'interopmetas': 'true'})
-        response.raise_for_status()
-        ods_dataset = response.json()
+        if self.has_feature('incremental'):
+            if self.is_unchanged(self.local_modified_at(item), item.kwargs.get('modified')):
+                msg = 'Dataset {0} has not been modified since last harvest'
+                raise HarvestSkipException(msg.format(dataset_id))
+
+        ods_dataset = self.get_ods_dataset(item)
         ods_metadata = ods_dataset['metas']
         ods_interopmetas = ods_dataset.get('interop_metas', {})
 
@@ -149,51 +943,59 @@ class OdsBackend(BaseBackend):
             msg = 'Dataset {datasetid} has INSPIRE metadata'
             raise HarvestSkipException(msg.format(**ods_dataset))
 
-        dataset = self.get_dataset(item.remote_id)
+        dataset = self.get_local_dataset(item)
         if not dataset.harvest:
             dataset.harvest = HarvestDatasetMetadata()
 
         dataset.title = ods_metadata['title']
         dataset.frequency = 'unknown'
         description = ods_metadata.get('description', '').strip()
-        dataset.description = parse_html(description)
+        # Only convert descriptions which changed since the last harvest
+        digest = sha1(description.encode('utf-8')).hexdigest()
+        if getattr(dataset.harvest, 'ods_description_digest', None) != digest:
+            with self.stage('description'):
+                dataset.description = html_to_markdown(description)
+            dataset.harvest.ods_description_digest = digest
         dataset.private = False
-        dataset.harvest.modified_at = ods_metadata['modified']
+        # Parsed once for all stages, left to the field validation if invalid
+        dataset.harvest.modified_at = (self.parse_date(ods_metadata['modified'])
+                                       or ods_metadata['modified'])
 
-        tags = set()
-        if 'keyword' in ods_metadata:
-            if isinstance(ods_metadata['keyword'], list):
-                tags |= set(ods_metadata['keyword'])
-            else:
-                tags.add(ods_metadata['keyword'])
+        with self.stage('tags'):
+            tags = set()
+            if 'keyword' in ods_metadata:
+                if isinstance(ods_metadata['keyword'], list):
+                    tags |= set(ods_metadata['keyword'])
+                else:
+                    tags.add(ods_metadata['keyword'])
 
-        if 'theme' in ods_metadata:
-            if isinstance(ods_metadata['theme'], list):
-                for theme in ods_metadata['theme']:
-                    tags.update([t.strip().lower() for t in theme.split(',')])
-            else:
-                themes = ods_metadata['theme'].split(',')
-                tags.update([t.strip().lower() for t in themes])
+            if 'theme' in ods_metadata:
+                if isinstance(ods_metadata['theme'], list):
+                    for theme in ods_metadata['theme']:
+                        tags.update([t.strip().lower() for t in theme.split(',')])
+                else:
+                    themes = ods_metadata['theme'].split(',')
+                    tags.update([t.strip().lower() for t in themes])
 
-        dataset.tags = list(tags)
+            dataset.tags = list(tags)
 
         # Detect license
-        default_license = dataset.license or License.default()
-        license_id = ods_metadata.get('license')
-        dataset.license = License.guess(license_id,
-                                        self.LICENSES.get(license_id),
-                                        default=default_license)
+        with self.stage('license'):
+            license = self.guess_license(ods_metadata.get('license'))
+            dataset.license = license or dataset.license or self.default_license()
 
-        self.process_resources(dataset, ods_dataset, ('csv', 'json'))
+        with self.stage('resources'):
+            resources = self.index_resources(dataset)
+            self.process_resources(dataset, ods_dataset, ('csv', 'json'), resources)
 
-        if 'geo' in ods_dataset['features']:
-            exports = ['geojson']
-            if ods_metadata['records_count'] <= self.SHAPEFILE_RECORDS_LIMIT:
-                exports.append('shp')
-            self.process_resources(dataset, ods_dataset, exports)
+            if 'geo' in ods_dataset['features']:
+                exports = ['geojson']
+                if ods_metadata['records_count'] <= self.SHAPEFILE_RECORDS_LIMIT:
+                    exports.append('shp')
+                self.process_resources(dataset, ods_dataset, exports, resources)
 
-        self.process_extra_files(dataset, ods_dataset, 'alternative_export')
-        self.process_extra_files(dataset, ods_dataset, 'attachment')
+            self.process_extra_files(dataset, ods_dataset, 'alternative_export', resources)
+            self.process_extra_files(dataset, ods_dataset, 'attachment', resources)
 
         dataset.harvest.ods_url = self.explore_url(dataset_id)
         dataset.harvest.remote_url = self.explore_url(dataset_id)
@@ -202,15 +1004,29 @@ class OdsBackend(BaseBackend):
         dataset.harvest.ods_has_records = ods_dataset['has_records']
         dataset.harvest.ods_geo = 'geo' in ods_dataset['features']
 
+        if self.timings:
+            self.processed_at = time.perf_counter()
         return dataset
 
-    def process_extra_files(self, dataset, data, data_type):
+    def autoarchive(self):
+        # Unmodified datasets are not listed by delta harvests
+        if self.job.data.get('ods_delta'):
+            return
+        super().autoarchive()
+
+    def end(self):
+        if self.has_feature('search_payloads'):
+            self.payloads.clear()
+        super().end()
+
+    def process_extra_files(self, dataset, data, data_type, resources=None):
+        resources = self.index_resources(dataset) if resources is None else resources
         dataset_id = data['datasetid']
         modified_at = self.parse_date(data['metas']['modified'])
         plural_type = '{0}s'.format(data_type)
         for export in data.get(plural_type, []):
             url = self.extra_file_url(dataset_id, export['id'], plural_type)
-            created, resource = self.get_resource(dataset, url)
+            created, resource = self.get_resource(dataset, url, resources)
             if not resource.harvest:
                 resource.harvest = HarvestResourceMetadata()
             resource.title = export.get('title', 'No title')
@@ -222,17 +1038,43 @@ class OdsBackend(BaseBackend):
             resource.harvest.modified_at = modified_at
             resource.harvest.ods_type = data_type
             if created:
-                dataset.resources.append(resource)
+                self.add_resource(dataset, resource, resources)
+
+    def guess_license(self, license_id):
+        '''Resolve an ODS license string, using the licenses cache'''
+        def resolve():
+            return License.guess(license_id, self.LICENSES.get(license_id))
+        return self.licenses.get(license_id, resolve)
+
+    def default_license(self):
+        return self.licenses.get(DEFAULT_LICENSE_KEY, License.default)
 
-    def get_resource(self, dataset, url):
-        resource = get_by(dataset.resources, 'url', url)
+    def index_resources(self, dataset):
+        '''Index a dataset resources by URL (the first one wins, as with `get_by`)'''
+        resources = {}
+        for resource in dataset.resources:
+            resources.setdefault(resource.url, resource)
+        return resources
+
+    def get_resource(self, dataset, url, resources=None):
+        if resources is None:
+            resource = get_by(dataset.resources, 'url', url)
+        else:
+            resource = resources.get(url)
         if not resource:
             return True, Resource(url=url)
         return False, resource
 
-    def process_resources(self, dataset, data, formats):
+    def add_resource(self, dataset, resource, resources=None):
+        '''Append a resource to a dataset, keeping its resources index up to date'''
+        dataset.resources.append(resource)
+        if resources is not None:
+            resources.setdefault(resource.url, resource)
+
+    def process_resources(self, dataset, data, formats, resources=None):
         if not data.get('has_records'):
             return
+        resources = self.index_resources(dataset) if resources is None else resources
         dataset_id = data['datasetid']
         ods_metadata = data['metas']
         modified_at = self.parse_date(ods_metadata['modified'])
@@ -240,7 +1082,7 @@ class OdsBackend(BaseBackend):
         for _format in formats:
             label, udata_format, mime = self.FORMATS[_format]
             url = self.download_url(dataset_id, _format)
-            created, resource = self.get_resource(dataset, url)
+            created, resource = self.get_resource(dataset, url, resources)
             if not resource.harvest:
                 resource.harvest = HarvestResourceMetadata()
             resource.title = _('{format} format export').format(format=label)
@@ -251,20 +1093,17 @@ class OdsBackend(BaseBackend):
             resource.harvest.modified_at = modified_at
             resource.harvest.ods_type = 'api'
             if created:
-                dataset.resources.append(resource)
+                self.add_resource(dataset, resource, resources)
 
     def description_from_fields(self, fields):
         '''Build a resource description/schema from ODS API fields'''
         if not fields:
             return
-
-        out = ''
-        for field in fields:
-            out += '- *{label}*: {name}[{type}]'.format(**field)
-            if field.get('description'):
-                out += ' {description}'.format(**field)
-            out += '\n'
-        return out
+        # Shared by all the exports of a dataset, and by datasets with the same schema
+        return fields_description(tuple(
+            (field['label'], field['name'], field['type'], field.get('description'))
+            for field in fields
+        ))
 
     def parse_date(self, date_str):
         try:
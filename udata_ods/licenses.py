@@ -0,0 +1,52 @@
+'''
+Process-wide cache of resolved licenses
+'''
+import threading
+import time
+
+
+class LicenseCache(object):
+    '''
+    Keep resolved licenses (or their absence) by key for `ttl` seconds.
+
+    A catalog only uses a handful of distinct license strings,
+    so each of them is only resolved once in a while instead of once per dataset.
+    '''
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, resolve):
+        '''Get the license cached for `key`, calling `resolve()` if missing or expired'''
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry and now - entry[0] < self.ttl:
+            return entry[1]
+        license = resolve()
+        with self._lock:
+            self.entries[key] = (now, license)
+        return license
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_license_cache(ttl=300):
+    '''Get the process-wide licenses cache for a given TTL'''
+    with _caches_lock:
+        if ttl not in _caches:
+            _caches[ttl] = LicenseCache(ttl)
+        return _caches[ttl]
+
+
+def clear_license_caches():
+    with _caches_lock:
+        for cache in _caches.values():
+            cache.clear()
@@ -0,0 +1,76 @@
+'''
+Harvest stages timings
+'''
+import threading
+import time
+
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds (in seconds) of the timings histograms buckets, and their keys
+BUCKETS = (
+    (0.001, 'le_1ms'),
+    (0.01, 'le_10ms'),
+    (0.1, 'le_100ms'),
+    (1, 'le_1s'),
+    (10, 'le_10s'),
+    (float('inf'), 'gt_10s'),
+)
+
+# Returned by `stage()` when timings are disabled
+DISABLED = nullcontext()
+
+
+class StageTimings(object):
+    '''
+    Aggregate the wall time of harvest stages as histograms.
+
+    Each stage gets a `count`, a `total` and a `max` duration (in seconds)
+    and a count per duration bucket (see `BUCKETS`).
+    Each measure is also given to the optional `hook(stage, seconds, tags)`
+    (ie. to forward them to a statsd or Prometheus client).
+    '''
+    def __init__(self, hook=None, tags=None):
+        self.hook = hook
+        self.tags = tags or {}
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        '''Measure the wall time of a block, even if it raises'''
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def observe(self, name, elapsed):
+        bucket = next(key for limit, key in BUCKETS if elapsed <= limit)
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {'count': 0, 'total': 0, 'max': 0}
+            stage['count'] += 1
+            stage['total'] += elapsed
+            stage['max'] = max(stage['max'], elapsed)
+            stage[bucket] = stage.get(bucket, 0) + 1
+        if self.hook:
+            self.hook(name, elapsed, self.tags)
+
+    def drain(self):
+        '''Return and reset the stages aggregated since the last call'''
+        with self._lock:
+            stages, self.stages = self.stages, {}
+        return stages
+
+
+def merge_timings(target, stages):
+    '''Merge drained stages into `target` (ie. the job timings)'''
+    for name, stage in stages.items():
+        merged = target.setdefault(name, {})
+        for key, value in stage.items():
+            if key == 'max':
+                merged[key] = max(merged.get(key, 0), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return target
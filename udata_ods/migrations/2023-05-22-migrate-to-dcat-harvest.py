@@ -8,14 +8,11 @@ from urllib.parse import urlencode, urlparse
 from udata.models import Dataset
 from udata.harvest.models import HarvestSource
 
-from udata_ods.harvesters import OdsBackend
+from udata_ods.explore import ODS_API_PATH, build_where_clause
 
 log = logging.getLogger(__name__)
 
 
-ODS_API_PATH = 'api/explore/v2.1'
-
-
 def dataset_home_url(source_url, dataset_id):
     return f'{source_url}/explore/dataset/{dataset_id}/'
 
@@ -28,18 +25,6 @@ def dcat_catalog_url(source_url):
     return f'{source_url}/{ODS_API_PATH}/catalog/exports/dcat/'
 
 
-def build_where_clause(filters):
-    if not filters:
-        return {}
-    params = []
-    for f in filters:
-        ods_key = OdsBackend.FILTERS.get(f['key'], f['key'])
-        op = 'NOT ' if f.get('type') == 'exclude' else ''
-        params.append(op + ods_key + f'="{f["value"]}"')
-    where_clause = {"where": ' AND '.join(params)}
-    return where_clause
-
-
 def ods_to_dcat_catalog_url(url, config):
     dcat_url = dcat_catalog_url(url)
     params = build_where_clause(config.get('filters'))
@@ -0,0 +1,43 @@
+'''
+Adaptive search pages sizing
+'''
+
+
+class AdaptivePageSize(object):
+    '''
+    Compute the search page size from the latency and the size of the previous pages.
+
+    Pages are sized to be fetched within `target_latency` seconds
+    and to weigh less than `target_size` bytes, between `min_rows` and `max_rows`.
+    The page size at most doubles from a page to the next one but shrinks immediately.
+    '''
+    GROWTH = 2
+
+    def __init__(self, rows, min_rows=10, max_rows=1000, target_latency=2,
+                 target_size=4 * 1024 ** 2):
+        self.min_rows = min_rows
+        self.max_rows = max(max_rows, min_rows)
+        self.target_latency = target_latency
+        self.target_size = target_size
+        self.rows = self.clamp(rows)
+
+    def clamp(self, rows):
+        return int(min(max(rows, self.min_rows), self.max_rows))
+
+    def limit(self, max_rows):
+        '''Lower the maximum page size (ie. to the server one)'''
+        self.max_rows = max(min(self.max_rows, max_rows), 1)
+        self.min_rows = min(self.min_rows, self.max_rows)
+        self.rows = self.clamp(self.rows)
+
+    def observe(self, count, elapsed, size):
+        '''Adapt the page size given a page datasets count, fetch duration and size in bytes'''
+        if not count:
+            return self.rows
+        rows = self.rows * self.GROWTH
+        if elapsed > 0:
+            rows = min(rows, self.target_latency * count / elapsed)
+        if size > 0:
+            rows = min(rows, self.target_size * count / size)
+        self.rows = self.clamp(rows)
+        return self.rows
@@ -0,0 +1,90 @@
+'''
+Harvest items profiling
+'''
+import cProfile
+import os
+import pstats
+import random
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+
+def location(filename, lineno):
+    '''A compact code location, keeping the file and its parent directory'''
+    parts = filename.replace(os.sep, '/').rsplit('/', 2)
+    return '{0}:{1}'.format('/'.join(parts[-2:]), lineno)
+
+
+class ItemProfiler(object):
+    '''
+    Profile harvest items with `cProfile` (and optionally `tracemalloc`).
+
+    Either a `rate` fraction of the items is sampled,
+    or, given a latency `threshold` (in seconds), all items are profiled
+    but only those slower than it are reported.
+    A report gives the `top` functions by own time and the `top` allocating lines.
+    Only the processing thread is profiled (not the concurrent fetches).
+    '''
+    def __init__(self, rate=0, threshold=None, memory=False, top=10):
+        self.rate = rate
+        self.threshold = threshold
+        self.memory = memory
+        self.top = top
+
+    def sampled(self):
+        return self.threshold is not None or random.random() < self.rate
+
+    @contextmanager
+    def profile(self, reports, **infos):
+        '''
+        Profile a block, appending its report to `reports` if kept.
+
+        The report includes `infos`, which are yielded to be completed by the block.
+        '''
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Another profiler is active
+            yield infos
+            return
+        trace = self.memory and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            yield infos
+        finally:
+            elapsed = time.perf_counter() - started
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot() if self.memory else None
+            if trace:
+                tracemalloc.stop()
+            if self.threshold is None or elapsed >= self.threshold:
+                reports.append(self.report(elapsed, profiler, snapshot, infos))
+
+    def report(self, elapsed, profiler, snapshot, infos):
+        stats = pstats.Stats(profiler).stats
+        hotspots = sorted(stats.items(), key=lambda stat: stat[1][2], reverse=True)[:self.top]
+        report = dict(infos, seconds=elapsed, functions=[{
+            'function': '{0}({1})'.format(location(filename, lineno), name),
+            'calls': calls,
+            'own': own,
+            'cumulative': cumulative,
+        } for (filename, lineno, name), (_, calls, own, cumulative, _) in hotspots])
+        if snapshot:
+            report['allocations'] = [{
+                'line': location(stat.traceback[0].filename, stat.traceback[0].lineno),
+                'size': stat.size,
+                'count': stat.count,
+            } for stat in snapshot.statistics('lineno')[:self.top]]
+        return report
+
+
+def merge_profiles(target, reports, limit):
+    '''Keep the `limit` slowest reports from `target` and `reports`'''
+    target.extend(reports)
+    target.sort(key=lambda report: report['seconds'], reverse=True)
+    del target[limit:]
+    return target
@@ -0,0 +1,123 @@
+'''
+Requests rate limiting per ODS domain
+'''
+import threading
+import time
+
+from mongoengine.connection import get_db
+from pymongo.errors import DuplicateKeyError
+
+
+class TokenBucket(object):
+    '''
+    An in-process token bucket allowing `rate` requests per second with bursts of `burst` requests.
+
+    It is implemented as a Generic Cell Rate Algorithm: the bucket state is the
+    theoretical arrival time (`tat`) of the next request.
+    The rate is adaptive: it is halved on throttling (down to `MIN_FACTOR`)
+    and slowly recovers on successful requests.
+    '''
+    MIN_FACTOR = 1 / 16
+    RECOVERY = 1.05
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tat = None
+        self.factor = 1.0
+        self._lock = threading.Lock()
+
+    def schedule(self, tat, factor, now):
+        '''
+        Compute the new theoretical arrival time and the delay to wait
+        before performing a request at `now`.
+        '''
+        interval = 1 / (self.rate * factor)
+        tat = now if tat is None else tat
+        start = max(now, tat - (self.burst - 1) * interval)
+        return max(tat, now) + interval, start - now
+
+    def reserve(self):
+        '''Reserve a request slot, returning the delay to wait before using it'''
+        with self._lock:
+            self.tat, delay = self.schedule(self.tat, self.factor, time.time())
+        return delay
+
+    def acquire(self):
+        '''Wait for a request slot. Return the waited delay'''
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return max(delay, 0)
+
+    def throttled(self):
+        with self._lock:
+            self.factor = max(self.factor / 2, self.MIN_FACTOR)
+
+    def succeeded(self):
+        if self.factor < 1:
+            with self._lock:
+                self.factor = min(self.factor * self.RECOVERY, 1.0)
+
+
+class SharedTokenBucket(TokenBucket):
+    '''
+    A token bucket whose state is stored in MongoDB,
+    shared by all the workers harvesting a same domain.
+    '''
+    COLLECTION = 'ods_rate_limits'
+
+    def __init__(self, key, rate, burst=1):
+        super().__init__(rate, burst)
+        self.key = key
+
+    @property
+    def collection(self):
+        return get_db()[self.COLLECTION]
+
+    def reserve(self):
+        while True:
+            now = time.time()
+            state = self.collection.find_one({'_id': self.key})
+            if state is None:
+                tat, delay = self.schedule(None, 1.0, now)
+                try:
+                    self.collection.insert_one({'_id': self.key, 'tat': tat, 'factor': 1.0})
+                except DuplicateKeyError:
+                    continue
+                return delay
+            self.factor = state['factor']
+            tat, delay = self.schedule(state['tat'], self.factor, now)
+            # Compare-and-set: retry if another worker reserved a slot in the meantime
+            result = self.collection.update_one({'_id': self.key, 'tat': state['tat']},
+                                                {'$set': {'tat': tat}})
+            if result.modified_count:
+                return delay
+
+    def throttled(self):
+        self.collection.update_one({'_id': self.key}, {'$mul': {'factor': 0.5}})
+        self.collection.update_one({'_id': self.key, 'factor': {'$lt': self.MIN_FACTOR}},
+                                   {'$set': {'factor': self.MIN_FACTOR}})
+
+    def succeeded(self):
+        # Factor is known from the last reservation: only write when recovering
+        if self.factor < 1:
+            self.collection.update_one({'_id': self.key}, {'$mul': {'factor': self.RECOVERY}})
+            self.collection.update_one({'_id': self.key, 'factor': {'$gt': 1}},
+                                       {'$set': {'factor': 1.0}})
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(domain, rate, burst=1, shared=False):
+    '''Get the process-wide rate limiter for a given domain'''
+    key = (domain, rate, burst, shared)
+    with _limiters_lock:
+        if key not in _limiters:
+            if shared:
+                _limiters[key] = SharedTokenBucket(domain, rate, burst)
+            else:
+                _limiters[key] = TokenBucket(rate, burst)
+        return _limiters[key]
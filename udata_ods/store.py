@@ -0,0 +1,101 @@
+'''
+Per-job storage of ODS search payloads
+'''
+import json
+import os
+import shutil
+import tempfile
+
+from hashlib import sha1
+
+from flask import current_app
+
+
+class PayloadStore(object):
+    '''
+    Keep the dataset payloads returned by the ODS search API for a given job
+    so they can be reused when processing items.
+
+    Payloads are serialized on the job items `kwargs` (thus persisted with the job
+    and available from any worker) until `max_size` bytes are stored.
+    Above this limit, they are spilled to disk in a per-job directory.
+    '''
+    KEY = 'ods_payload'
+    PATH_KEY = 'ods_payload_path'
+
+    # Default amount of bytes stored into the job document
+    MAX_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, job, max_size=None, directory=None):
+        self.job = job
+        self.max_size = max_size or current_app.config.get('ODS_PAYLOADS_MAX_SIZE',
+                                                           self.MAX_SIZE)
+        self.root = directory or current_app.config.get('ODS_PAYLOADS_DIR')
+        self.size = 0
+        self._directory = None
+
+    @property
+    def directory(self):
+        if self._directory is None:
+            root = self.root or tempfile.gettempdir()
+            if self.job.id:
+                self._directory = os.path.join(root, 'udata-ods-{0}'.format(self.job.id))
+                os.makedirs(self._directory, exist_ok=True)
+            else:
+                # Dry runs have no persisted job
+                self._directory = tempfile.mkdtemp(prefix='udata-ods-', dir=root)
+        return self._directory
+
+    @staticmethod
+    def serialize(payload):
+        return json.dumps(payload, separators=(',', ':'))
+
+    def put(self, item, payload):
+        '''Store a dataset payload (or its serialized version) for a given item'''
+        data = payload if isinstance(payload, str) else self.serialize(payload)
+        if self.size + len(data) <= self.max_size:
+            item.kwargs[self.KEY] = data
+            self.size += len(data)
+            return
+        filename = '{0}.json'.format(sha1(item.remote_id.encode('utf8')).hexdigest())
+        path = os.path.join(self.directory, filename)
+        with open(path, 'w') as f:
+            f.write(data)
+        item.kwargs[self.PATH_KEY] = path
+
+    def has(self, item):
+        '''Whether a payload has been stored for a given item'''
+        return self.KEY in item.kwargs or self.PATH_KEY in item.kwargs
+
+    def get(self, item):
+        '''Get the stored payload for a given item if any'''
+        if item.kwargs.get(self.KEY):
+            return json.loads(item.kwargs[self.KEY])
+        path = item.kwargs.get(self.PATH_KEY)
+        if not path:
+            return
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # Spilled on another host or corrupted: let the caller fetch it
+            return
+
+    def pop(self, item):
+        '''Get and forget the stored payload for a given item'''
+        payload = self.get(item)
+        item.kwargs.pop(self.KEY, None)
+        path = item.kwargs.pop(self.PATH_KEY, None)
+        if path and os.path.exists(path):
+            os.remove(path)
+        return payload
+
+    def clear(self):
+        '''Forget all stored payloads for this job'''
+        for item in self.job.items:
+            item.kwargs.pop(self.KEY, None)
+            item.kwargs.pop(self.PATH_KEY, None)
+        if self._directory or self.job.id:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self._directory = None
+        self.size = 0
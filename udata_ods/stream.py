@@ -0,0 +1,105 @@
+'''
+Streaming JSON decoding of ODS API responses
+'''
+import codecs
+import json
+import re
+
+WHITESPACES = re.compile(r'[ \t\n\r]*')
+# What may remain of a number truncated at the end of the buffer (ie. `1.5e` decoded as `1.5`)
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*$')
+
+
+class JSONObjectStream(object):
+    '''
+    Decode a JSON object from byte chunks without loading the whole document.
+
+    Top-level members are yielded as `(key, value)` pairs,
+    except the `array_key` array whose items are yielded one by one as `(array_key, item)`.
+    Only the current member (or array item) is kept in memory.
+    '''
+    def __init__(self, chunks, array_key, encoding='utf-8'):
+        self.chunks = iter(chunks)
+        self.array_key = array_key
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def read(self):
+        '''Append the next chunk to the buffer, forgetting consumed data'''
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        try:
+            self.buffer += self.decoder.decode(next(self.chunks))
+        except StopIteration:
+            self.buffer += self.decoder.decode(b'', final=True)
+            self.eof = True
+
+    def peek(self):
+        '''Skip whitespaces and return the next character ('' at the end of the stream)'''
+        while True:
+            self.pos = WHITESPACES.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.read()
+
+    def expect(self, *chars):
+        char = self.peek()
+        if char not in chars:
+            msg = 'Expecting {0} at position {1}, got "{2}"'
+            raise ValueError(msg.format(' or '.join(chars), self.pos, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        '''Decode the next JSON value'''
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+                # A number ending the buffer may be truncated
+                truncated = (isinstance(value, (int, float)) and not isinstance(value, bool)
+                             and NUMBER_TAIL.match(self.buffer, end))
+                if not truncated or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read()
+
+    def __iter__(self):
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key == self.array_key and self.peek() == '[':
+                self.expect('[')
+                if self.peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield key, self.value()
+                        if self.expect(',', ']') == ']':
+                            break
+            else:
+                yield key, self.value()
+            if self.expect(',', '}') == '}':
+                return
+
+
+def iter_json_lines(chunks):
+    '''Decode JSON lines from byte chunks, one line at a time'''
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if pending.strip():
+        yield json.loads(pending)
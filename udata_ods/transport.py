@@ -0,0 +1,166 @@
+'''
+HTTP transport for ODS APIs
+'''
+import logging
+import random
+import threading
+import time
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from .breaker import CircuitOpenError
+
+log = logging.getLogger(__name__)
+
+
+class Transport(object):
+    '''
+    A pooled HTTP transport retrying throttled and failed requests
+    with an exponential backoff (honoring `Retry-After`).
+
+    Counters (`requests`, `retries`, `bytes` transferred (see `wire_size`),
+    `rate_limit_wait` seconds, `circuit_trips` and `circuit_rejected`) are gathered on `stats`
+    and on the optional per-call `stats` mapping.
+    '''
+    RETRY_STATUSES = (429, 502, 503, 504)
+    RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout)
+
+    def __init__(self, pool_size=10, max_retries=5, backoff=0.5, max_backoff=60, timeout=60):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Includes brotli when available
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def count(self, stats, key, value=1):
+        with self._lock:
+            for counters in (self.stats, stats):
+                if counters is not None:
+                    counters[key] = counters.get(key, 0) + value
+
+    def drain(self, stats):
+        '''Return and reset the counters of a per-call `stats` mapping'''
+        with self._lock:
+            drained = dict(stats)
+            stats.clear()
+        return drained
+
+    def backoff_delay(self, attempt):
+        '''Exponential backoff with full jitter'''
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def retry_after(self, response):
+        '''Parse the `Retry-After` header as seconds if any'''
+        value = response.headers.get('Retry-After')
+        if not value:
+            return
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                date = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return
+            delay = (date - datetime.now(timezone.utc)).total_seconds()
+        return min(max(delay, 0), self.max_backoff)
+
+    def get(self, url, stats=None, limiter=None, breaker=None, **kwargs):
+        '''
+        Perform a GET request, retrying if needed.
+
+        Each attempt waits for a slot from the optional rate `limiter`
+        and fails fast if the optional circuit `breaker` is open.
+        Streamed (`stream=True`) responses bytes are left to the caller to count.
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            if breaker:
+                try:
+                    breaker.before_request()
+                except CircuitOpenError:
+                    self.count(stats, 'circuit_rejected')
+                    raise
+            try:
+                waited = limiter.acquire() if limiter else 0
+            except Exception:
+                # Not a domain failure, but a half-open circuit should not keep waiting for a probe
+                if breaker:
+                    breaker.release()
+                raise
+            if waited:
+                self.count(stats, 'rate_limit_wait', waited)
+            self.count(stats, 'requests')
+            try:
+                response = self.session.get(url, **kwargs)
+            except self.RETRY_EXCEPTIONS:
+                if breaker and breaker.failure():
+                    self.count(stats, 'circuit_trips')
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+            except Exception:
+                # ie. an invalid URL or an undecodable body
+                if breaker:
+                    breaker.release()
+                raise
+            else:
+                if not kwargs.get('stream'):
+                    self.count(stats, 'bytes', wire_size(response))
+                if breaker:
+                    breaker.success()
+                if limiter and response.status_code == 429:
+                    limiter.throttled()
+                elif limiter:
+                    limiter.succeeded()
+                if response.status_code not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                response.close()
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+            attempt += 1
+            self.count(stats, 'retries')
+            log.debug('Retrying %s in %.2fs (attempt %s)', url, delay, attempt)
+            time.sleep(delay)
+
+
+def wire_size(response):
+    '''
+    The bytes of a response body read so far as transferred,
+    ie. before being decompressed (`0` for responses not read from the network).
+    '''
+    try:
+        return response.raw.tell()
+    except (AttributeError, ValueError):
+        return 0
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(url, **options):
+    '''
+    Get the process-wide transport for a given URL host and options,
+    allowing connections reuse across harvest items.
+    '''
+    key = (urlparse(url).netloc, tuple(sorted(options.items())))
+    with _transports_lock:
+        if key not in _transports:
+            _transports[key] = Transport(**options)
+        return _transports[key]